@@ -5,6 +5,7 @@ from django.contrib.auth.models import Group
 from account import models
 from account.forms import PremiumInvitationAdminForm
 
+from account.connectors.idp_interface import emails_exist
 from account.utils import send_premium_invitation, generate_activation_key
 
 from gluu_license.connectors.license_interface import sync_usage_records
@@ -45,6 +46,8 @@ class AccountAdmin(admin.ModelAdmin):
         'payment_on_platform', 'cc_attached', 'number_installations'
     )
 
+    list_select_related = ('counters',)
+
     actions = [sync_license_records]
 
 
@@ -106,12 +109,23 @@ admin.site.register(models.Credit, CreditAdmin)
 
 class PremiumInvitationAdmin(admin.ModelAdmin):
 
+    def resend_invitations(modeladmin, request, queryset):
+
+        invitations = queryset.exclude(activation_key__in=['', 'ACTIVATED'])
+        existing = emails_exist([invitation.email for invitation in invitations])
+
+        for invitation in invitations:
+            send_premium_invitation(invitation, existing[invitation.email])
+    resend_invitations.short_description = 'Resend selected invitations'
+
     form = PremiumInvitationAdminForm
     model = models.PremiumInvitation
 
     list_display = ('email', 'activation_key', 'created')
     readonly_fields = ('activation_key', )
 
+    actions = [resend_invitations]
+
     def save_model(self, request, obj, form, change):
 
         if not obj.activation_key:
@@ -121,3 +135,44 @@ class PremiumInvitationAdmin(admin.ModelAdmin):
             send_premium_invitation(obj)
 
 admin.site.register(models.PremiumInvitation, PremiumInvitationAdmin)
+
+
+class ScimUserAdmin(admin.ModelAdmin):
+
+    model = models.ScimUser
+
+    list_display = ('idp_uuid', 'email', 'phone_number', 'active', 'last_modified', 'synced')
+    search_fields = ('email', 'idp_uuid')
+    readonly_fields = ('synced',)
+
+admin.site.register(models.ScimUser, ScimUserAdmin)
+
+
+class ScimSyncAdmin(admin.ModelAdmin):
+
+    model = models.ScimSync
+
+    list_display = ('started', 'finished', 'full', 'count')
+
+admin.site.register(models.ScimSync, ScimSyncAdmin)
+
+
+class IdpOutboxAdmin(admin.ModelAdmin):
+
+    model = models.IdpOutbox
+
+    list_display = ('id', 'user', 'operation', 'status', 'attempts', 'next_attempt', 'created', 'processed')
+    list_filter = ('status', 'operation')
+    exclude = ('secret',)
+    readonly_fields = ('created', 'processed', 'last_error')
+
+admin.site.register(models.IdpOutbox, IdpOutboxAdmin)
+
+
+class BillingCountersAdmin(admin.ModelAdmin):
+
+    model = models.BillingCounters
+    list_display = ('account', 'installations', 'billed', 'paid', 'credit', 'updated')
+    readonly_fields = ('installations', 'billed', 'paid', 'credit', 'credit_expires', 'updated')
+
+admin.site.register(models.BillingCounters, BillingCountersAdmin)
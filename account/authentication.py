@@ -4,6 +4,8 @@ import requests
 from django.conf import settings
 from social.backends.oauth import BaseOAuth2
 
+from gluu_ecommerce.connectors import http_client
+
 from account.connectors.idp_interface import get_user
 
 GLUU_OAUTH2_SCOPE = ['openid', 'email', 'profile']
@@ -49,7 +51,7 @@ class GluuOAuth2Backend(BaseOAuth2):
                 'last_name': response.get('family_name', ''),
                 'idp_uuid': response.get('inum', '')}
 
-    def user_data(self, access_token, *args, **kwargs,**KeyError):
+    def user_data(self, access_token, *args, **kwargs):
 
         self.strategy.session_set('gluu_state', self.data['state'])
 
@@ -64,7 +66,7 @@ def gluuapis_profile(url, access_token):
 
     data = {'access_token': access_token, 'alt': 'json'}
 
-    r = requests.get(url, params=data, verify=settings.VERIFY_SSL)
+    r = http_client.get(url, params=data, verify=settings.VERIFY_SSL)
 
     if r.status_code == requests.codes.ok:
         return r.json()
@@ -80,7 +82,7 @@ def sync_phone_number(strategy, is_new, user, *args, **kwargs):
             user.phone_number = get_user(user)['phoneNumbers'][0]['value']
             user.save()
 
-    except (KeyError, AttributeError, IndexError) as e:
+    except (KeyError, AttributeError, IndexError, TypeError) as e:
         logger.info('{} doesn\'t have a phone number'.format(user.email))
 
     except Exception as e:
@@ -1,24 +1,75 @@
+import datetime
 import json
 import logging
 import random
-import requests
 
 from hashlib import sha1 as sha_constructor
 
 from django.conf import settings
+from django.core.cache import caches
+from django.core.exceptions import ObjectDoesNotExist
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
 
+from account.models import ScimSync, ScimUser
+
+from gluu_ecommerce.connectors import http_client
 from gluu_ecommerce.connectors.uma_access import obtain_authorized_rpt_token
 
 logger = logging.getLogger('idp')
 
 SCIM_CREATE_USER_ENDPOINT = 'https://idp.gluu.org/identity/seam/resource/restv1/scim/v2/Users/'
 SCIM_UPDATE_USER_ENDPOINT = 'https://idp.gluu.org/identity/seam/resource/restv1/scim/v2/Users/{}/'
+SCIM_BULK_ENDPOINT = 'https://idp.gluu.org/identity/seam/resource/restv1/scim/v2/Bulk/'
 
+SCIM_MIRROR_ATTRIBUTES = 'id,emails,phoneNumbers,name,displayName,active,meta'
+
+EMAIL_EXISTS_CACHE_KEY = 'scim:email:{}'
+
+
+def normalize_email(email):
+    return email.strip().lower()
+
+
+def email_cache_key(email):
+    return EMAIL_EXISTS_CACHE_KEY.format(
+        sha_constructor(normalize_email(email).encode('utf-8')).hexdigest())
 
-def create_user(user, password, active=False):
+
+def invalidate_email(email):
+    caches[settings.SCIM_CACHE].delete(email_cache_key(email))
+
+
+def scim_request(method, url, params=None, **kwargs):
 
     headers = {'Content-Type': 'application/json'}
-    params = {}
+    params = params or {}
+
+    if settings.SCIM_TEST_MODE:
+        params['access_token'] = settings.SCIM_TEST_MODE_ACCESS_TOKEN
+
+    else:
+        rpt = obtain_authorized_rpt_token(resource_uri=url)
+        headers['Authorization'] = 'Bearer {}'.format(rpt)
+
+    response = http_client.request(
+        method, url, verify=settings.VERIFY_SSL, headers=headers, params=params, **kwargs)
+
+    if response.status_code == 401 and not settings.SCIM_TEST_MODE:
+
+        # The cached RPT was rejected, e.g. revoked or expired early on the idp side
+        logger.info('RPT rejected for {}, refreshing tokens'.format(url))
+
+        rpt = obtain_authorized_rpt_token(resource_uri=url, force_refresh=True)
+        headers['Authorization'] = 'Bearer {}'.format(rpt)
+
+        response = http_client.request(
+            method, url, verify=settings.VERIFY_SSL, headers=headers, params=params, **kwargs)
+
+    return response
+
+
+def user_payload(user, password, active=False):
 
     payload = {
         'schemas': ['urn:ietf:params:scim:schemas:core:2.0:User'],
@@ -37,22 +88,14 @@ def create_user(user, password, active=False):
     if active:
         payload['active'] = True
 
-    url = SCIM_CREATE_USER_ENDPOINT
+    return payload
 
-    if settings.SCIM_TEST_MODE:
-        params['access_token'] = settings.SCIM_TEST_MODE_ACCESS_TOKEN
 
-    else:
-        rpt = obtain_authorized_rpt_token(resource_uri=url)
-        headers['Authorization'] = 'Bearer {}'.format(rpt)
+def create_user(user, password, active=False):
 
-    response = requests.post(
-        url,
-        data=json.dumps(payload),
-        verify=settings.VERIFY_SSL,
-        headers=headers,
-        params=params
-    )
+    payload = user_payload(user, password, active)
+
+    response = scim_request('POST', SCIM_CREATE_USER_ENDPOINT, data=json.dumps(payload))
 
     if response.status_code != 201:
         message = 'Error writing to idp: {} {}'.format(response.status_code, response.text)
@@ -60,44 +103,94 @@ def create_user(user, password, active=False):
         raise Exception(message)
 
     else:
+        invalidate_email(user.email)
         response = response.json()
+        mirror_user(response)
         return response['id']
 
 
 def activate_user(user):
 
-    headers = {'Content-Type': 'application/json'}
-    params = {}
-
     url = SCIM_UPDATE_USER_ENDPOINT.format(user.idp_uuid)
 
-    if settings.SCIM_TEST_MODE:
-        params['access_token'] = settings.SCIM_TEST_MODE_ACCESS_TOKEN
+    payload = {'active': True}
 
-    else:
-        rpt = obtain_authorized_rpt_token(resource_uri=url)
-        headers['Authorization'] = 'Bearer {}'.format(rpt)
+    response = scim_request('PUT', url, data=json.dumps(payload))
 
-    payload = {'active': True}
+    if response.status_code != 200:
+        message = 'Error writing to idp: {} {}'.format(response.status_code, response.text)
+        logger.error(message)
+        raise Exception(message)
 
-    response = requests.put(
-        url,
-        data=json.dumps(payload),
-        verify=settings.VERIFY_SSL,
-        headers=headers,
-        params=params
-    )
+
+def bulk_create_users(users):
+
+    # Creates several users with one SCIM /Bulk request. `users` maps a bulk id
+    # to a (user, password, active) tuple, the result maps every bulk id to the
+    # new idp uuid, or None when that operation failed.
+
+    operations = []
+    payloads = {}
+
+    for bulk_id, (user, password, active) in users.items():
+
+        payloads[bulk_id] = user_payload(user, password, active)
+
+        operations.append({
+            'method': 'POST',
+            'path': '/Users',
+            'bulkId': str(bulk_id),
+            'data': payloads[bulk_id]
+        })
+
+    payload = {
+        'schemas': ['urn:ietf:params:scim:api:messages:2.0:BulkRequest'],
+        'Operations': operations
+    }
+
+    response = scim_request('POST', SCIM_BULK_ENDPOINT, data=json.dumps(payload))
 
     if response.status_code != 200:
         message = 'Error writing to idp: {} {}'.format(response.status_code, response.text)
         logger.error(message)
         raise Exception(message)
 
+    results = dict((bulk_id, None) for bulk_id in users)
+    bulk_ids = dict((str(bulk_id), bulk_id) for bulk_id in users)
 
-def update_user(user):
+    for operation in response.json().get('Operations', []):
 
-    headers = {'Content-Type': 'application/json'}
-    params = {}
+        bulk_id = bulk_ids.get(operation.get('bulkId'))
+        status = operation.get('status')
+
+        if isinstance(status, dict):
+            status = status.get('code')
+
+        if bulk_id is None:
+            continue
+
+        if str(status) != '201':
+            logger.error('Error writing to idp: {} {}'.format(status, operation.get('response')))
+            continue
+
+        user = users[bulk_id][0]
+        invalidate_email(user.email)
+        results[bulk_id] = operation['location'].rstrip('/').split('/')[-1]
+
+        # Mirrored like single creations, from the returned resource when
+        # the idp sends one and otherwise from what was posted
+        resource = operation.get('response')
+
+        if not isinstance(resource, dict) or 'id' not in resource:
+            resource = dict(payloads[bulk_id], id=results[bulk_id])
+            del resource['password']
+
+        mirror_user(resource)
+
+    return results
+
+
+def update_user(user):
 
     if not user.idp_uuid:
         logger.error('Error writing to idp, missing uid: {}'.format(user.email))
@@ -105,13 +198,6 @@ def update_user(user):
 
     url = SCIM_UPDATE_USER_ENDPOINT.format(user.idp_uuid)
 
-    if settings.SCIM_TEST_MODE:
-        params['access_token'] = settings.SCIM_TEST_MODE_ACCESS_TOKEN
-
-    else:
-        rpt = obtain_authorized_rpt_token(resource_uri=url)
-        headers['Authorization'] = 'Bearer {}'.format(rpt)
-
     payload = {
         'name': {'givenName': user.first_name, 'familyName': user.last_name},
         'displayName': u'{}{}'.format(user.first_name, user.last_name),
@@ -122,13 +208,7 @@ def update_user(user):
         'title': user.job_title
     }
 
-    response = requests.put(
-        url,
-        data=json.dumps(payload),
-        verify=settings.VERIFY_SSL,
-        headers=headers,
-        params=params
-    )
+    response = scim_request('PUT', url, data=json.dumps(payload))
 
     if response.status_code != 200:
         message = 'Error writing to idp: {} {}'.format(response.status_code, response.text)
@@ -136,27 +216,33 @@ def update_user(user):
         raise Exception(message)
 
     else:
+        mirror_user(response.json())
         logger.info('Successfully updated {}'.format(user.email))
 
 
-def get_user(user):
+def get_user(user, live=False):
+
+    # Reads from the local mirror unless `live` is set, so that logins don't
+    # block on the idp. Live reads refresh the mirror.
 
     if not user.idp_uuid:
         logger.error('Error writing to idp, missing uid: {}'.format(user.email))
         return
 
-    headers = {'Content-Type': 'application/json'}
-    params = {}
-    url = SCIM_UPDATE_USER_ENDPOINT.format(user.idp_uuid)
+    if not live:
 
-    if settings.SCIM_TEST_MODE:
-        params['access_token'] = settings.SCIM_TEST_MODE_ACCESS_TOKEN
+        try:
+            return ScimUser.objects.get(idp_uuid=user.idp_uuid).attributes
 
-    else:
-        rpt = obtain_authorized_rpt_token(resource_uri=url)
-        headers['Authorization'] = 'Bearer {}'.format(rpt)
+        except ObjectDoesNotExist:
+
+            if not settings.SCIM_MIRROR_LIVE_FALLBACK:
+                logger.info('{} is not mirrored yet'.format(user.email))
+                return
 
-    response = requests.get(url, verify=settings.VERIFY_SSL, headers=headers)
+    url = SCIM_UPDATE_USER_ENDPOINT.format(user.idp_uuid)
+
+    response = scim_request('GET', url)
 
     if response.status_code != 200:
         message = 'Error retrieving idp: {} {}'.format(response.status_code, response.text)
@@ -164,25 +250,124 @@ def get_user(user):
         raise Exception(message)
 
     else:
-        return response.json()
+        resource = response.json()
+        mirror_user(resource)
+        return resource
+
+
+def list_users(modified_since=None):
+
+    # Pages through the SCIM users, optionally only those modified since the
+    # given datetime. `ge` rather than `gt` as lastModified has a resolution
+    # of one second and mirroring a user twice is harmless.
+
+    params = {'attributes': SCIM_MIRROR_ATTRIBUTES, 'count': settings.SCIM_PAGE_SIZE}
+
+    if modified_since:
+        params['filter'] = 'meta.lastModified ge "{}"'.format(
+            modified_since.astimezone(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ'))
+
+    start_index = 1
+
+    while True:
+
+        params['startIndex'] = start_index
+
+        response = scim_request('GET', SCIM_CREATE_USER_ENDPOINT, params=params)
+
+        if response.status_code != 200:
+            message = 'Error retrieving from idp: {} {}'.format(response.status_code, response.text)
+            logger.error(message)
+            raise Exception(message)
+
+        page = response.json()
+        resources = page.get('Resources', [])
+
+        for resource in resources:
+            yield resource
+
+        start_index += len(resources)
+
+        if not resources or start_index > int(page['totalResults']):
+            break
+
+
+def mirror_user(resource):
+
+    emails = resource.get('emails') or [{}]
+    phone_numbers = resource.get('phoneNumbers') or [{}]
+
+    last_modified = resource.get('meta', {}).get('lastModified')
+
+    ScimUser.objects.update_or_create(
+        idp_uuid=resource['id'],
+        defaults={
+            'email': emails[0].get('value', ''),
+            'phone_number': phone_numbers[0].get('value', ''),
+            'active': bool(resource.get('active')),
+            'attributes': resource,
+            'last_modified': parse_datetime(last_modified) if last_modified else None
+        }
+    )
+
+
+def sync_users(full=False):
+
+    # The watermark is only moved by a completed sync. Users mirrored on
+    # their own by create_user, update_user or get_user don't prove that the
+    # changes before them were synced.
+
+    started = timezone.now()
+
+    modified_since = None
+
+    if not full:
+
+        last_sync = ScimSync.objects.order_by('-started').first()
+
+        # Overlaps the last sync a little, for clock skew with the idp
+        if last_sync is not None:
+            modified_since = last_sync.started - datetime.timedelta(seconds=settings.SCIM_SYNC_OVERLAP)
+
+    count = 0
+
+    for resource in list_users(modified_since):
+        mirror_user(resource)
+        count += 1
+
+    ScimSync.objects.create(started=started, full=full or modified_since is None, count=count)
+
+    return count
 
 
 def email_exists(email):
 
-    headers = {'Content-Type': 'application/json'}
+    # Read-through cache, a missing email is only cached briefly as it may be
+    # registered on the idp at any time
 
-    url = SCIM_CREATE_USER_ENDPOINT
+    cache = caches[settings.SCIM_CACHE]
+    key = email_cache_key(email)
 
-    params = {'filter': 'emails.value eq "{}"'.format(email)}
+    exists = cache.get(key)
 
-    if settings.SCIM_TEST_MODE:
-        params['access_token'] = settings.SCIM_TEST_MODE_ACCESS_TOKEN
+    if exists is None:
 
-    else:
-        rpt = obtain_authorized_rpt_token(resource_uri=url)
-        headers['Authorization'] = 'Bearer {}'.format(rpt)
+        exists = lookup_email(email)
+
+        if exists:
+            cache.set(key, exists, settings.SCIM_EMAIL_EXISTS_TTL)
+
+        else:
+            cache.set(key, exists, settings.SCIM_EMAIL_MISSING_TTL)
 
-    response = requests.get(url, verify=settings.VERIFY_SSL, headers=headers, params=params)
+    return exists
+
+
+def lookup_email(email):
+
+    params = {'filter': 'emails.value eq "{}"'.format(email)}
+
+    response = scim_request('GET', SCIM_CREATE_USER_ENDPOINT, params=params)
 
     if response.status_code != 200:
 
@@ -196,8 +381,120 @@ def email_exists(email):
 
         if no_records not in [0, 1]:
 
-            message = 'Unexpected number of records found for {}'.email
+            message = 'Unexpected number of records found for {}'.format(email)
             logger.error(message)
             raise Exception(message)
 
         return no_records == 1
+
+
+def find_user(email):
+
+    # The idp resource registered with the email, or None
+
+    params = {'filter': 'emails.value eq "{}"'.format(email), 'attributes': SCIM_MIRROR_ATTRIBUTES}
+
+    response = scim_request('GET', SCIM_CREATE_USER_ENDPOINT, params=params)
+
+    if response.status_code != 200:
+
+        message = 'Error retrieving from idp: {} {}'.format(response.status_code, response.text)
+        logger.error(message)
+        raise Exception(message)
+
+    response = response.json()
+
+    if int(response['totalResults']) not in [0, 1]:
+
+        message = 'Unexpected number of records found for {}'.format(email)
+        logger.error(message)
+        raise Exception(message)
+
+    resources = response.get('Resources', [])
+
+    if resources:
+        invalidate_email(email)
+        mirror_user(resources[0])
+        return resources[0]
+
+
+def emails_exist(emails):
+
+    # Batched email_exists: cached emails are answered from the cache and the
+    # rest is looked up with chunked SCIM `or` filters
+
+    cache = caches[settings.SCIM_CACHE]
+    keys = dict((email, email_cache_key(email)) for email in emails)
+
+    cached = cache.get_many(keys.values())
+
+    result = {}
+    missing = []
+
+    for email in emails:
+
+        if keys[email] in cached:
+            result[email] = cached[keys[email]]
+
+        else:
+            missing.append(email)
+
+    if missing:
+
+        found = lookup_emails(missing)
+
+        for email in missing:
+
+            result[email] = normalize_email(email) in found
+
+            if result[email]:
+                cache.set(keys[email], True, settings.SCIM_EMAIL_EXISTS_TTL)
+
+            else:
+                cache.set(keys[email], False, settings.SCIM_EMAIL_MISSING_TTL)
+
+    return result
+
+
+def lookup_emails(emails):
+
+    # The authorized RPT for the users endpoint is cached, so only the first
+    # chunk pays for the UMA handshake
+
+    emails = sorted(set(normalize_email(email) for email in emails))
+    chunk_size = settings.SCIM_FILTER_CHUNK_SIZE
+
+    found = set()
+
+    for start in range(0, len(emails), chunk_size):
+
+        chunk = emails[start:start + chunk_size]
+
+        params = {
+            'filter': ' or '.join('emails.value eq "{}"'.format(email) for email in chunk),
+            'attributes': 'emails',
+            'count': len(chunk)
+        }
+
+        response = scim_request('GET', SCIM_CREATE_USER_ENDPOINT, params=params)
+
+        if response.status_code != 200:
+
+            message = 'Error retrieving from idp: {} {}'.format(response.status_code, response.text)
+            logger.error(message)
+            raise Exception(message)
+
+        response = response.json()
+        resources = response.get('Resources', [])
+
+        if int(response['totalResults']) > len(resources):
+
+            message = 'Unexpected number of records found for {}'.format(', '.join(chunk))
+            logger.error(message)
+            raise Exception(message)
+
+        for resource in resources:
+            for email in resource.get('emails', []):
+                found.add(normalize_email(email['value']))
+
+    return found
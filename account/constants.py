@@ -2,4 +2,23 @@ INITAL_CREDIT = 50.00
 INITAL_CREDIT_EXPIRATION = 60
 CHARGE_DESCIRPTION = 'Gluu oxd license for {}'
 
-GENERIC_ERROR_DESCRIPTION_REGISTRATION = {'error': 'Registration Failed', 'description': 'Something went wrong.'}
\ No newline at end of file
+GENERIC_ERROR_DESCRIPTION_REGISTRATION = {'error': 'Registration Failed', 'description': 'Something went wrong.'}
+
+# Idp outbox
+CREATE_USER = 'CREATE'
+ACTIVATE_USER = 'ACTIVATE'
+
+IDP_OPERATION_CHOICES = (
+    (CREATE_USER, 'Create user'),
+    (ACTIVATE_USER, 'Activate user'),
+)
+
+OUTBOX_PENDING = 'PEND'
+OUTBOX_DONE = 'DONE'
+OUTBOX_FAILED = 'FAIL'
+
+OUTBOX_STATUS_CHOICES = (
+    (OUTBOX_PENDING, 'Pending'),
+    (OUTBOX_DONE, 'Done'),
+    (OUTBOX_FAILED, 'Failed'),
+)
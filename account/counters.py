@@ -0,0 +1,95 @@
+from django.db import IntegrityError, transaction
+from django.db.models import Case, FloatField, Min, Sum, When
+from django.utils import timezone
+
+from account.models import BillingCounters, Credit
+from gluu_license.models import LicenseRecord
+from payment import constants as payment_constants
+from payment.models import Payment
+
+
+def count_installations(account_id):
+
+    installations = LicenseRecord.objects.filter(license__account_id=account_id).aggregate(
+        Sum('number_licenses'))['number_licenses__sum']
+
+    return {'installations': installations or 0}
+
+
+def count_payments(account_id):
+
+    amounts = Payment.objects.filter(account_id=account_id).aggregate(
+        billed=Sum('amount'),
+        paid=Sum(Case(
+            When(status=payment_constants.PAID, then='amount'),
+            output_field=FloatField()
+        ))
+    )
+
+    return {'billed': amounts['billed'] or 0.00, 'paid': amounts['paid'] or 0.00}
+
+
+def count_credit(account_id):
+
+    credit = Credit.objects.filter(
+        account_id=account_id,
+        expires__gt=timezone.now(),
+        remaining_amount__gt=0.00
+    ).aggregate(credit=Sum('remaining_amount'), credit_expires=Min('expires'))
+
+    return {'credit': credit['credit'] or 0.00, 'credit_expires': credit['credit_expires']}
+
+
+def compute(account_id):
+
+    values = count_installations(account_id)
+    values.update(count_payments(account_id))
+    values.update(count_credit(account_id))
+
+    return values
+
+
+def create_counters(account):
+
+    try:
+        with transaction.atomic():
+            return BillingCounters.objects.create(account=account, **compute(account.pk))
+
+    except IntegrityError:
+        return BillingCounters.objects.get(account=account)
+
+
+def recount(account_id, count):
+
+    # Runs in the transaction of the write that changed the counted rows.
+    # Locking the counters row first serializes concurrent writers, each one
+    # then counts what the previous one committed. Accounts without counters
+    # get them on first read.
+
+    with transaction.atomic():
+
+        counters = list(BillingCounters.objects.select_for_update().filter(
+            account_id=account_id).values_list('pk', flat=True))
+
+        if counters:
+            BillingCounters.objects.filter(pk=counters[0]).update(
+                updated=timezone.now(), **count(account_id))
+
+
+def recount_installations(account_id):
+    recount(account_id, count_installations)
+
+
+def recount_payments(account_id):
+    recount(account_id, count_payments)
+
+
+def recount_credit(account_id):
+    recount(account_id, count_credit)
+
+
+def invalidate_counters(account_ids):
+
+    # For bulk writes that send no signals, the counters are recreated with a
+    # full count on their next read
+    BillingCounters.objects.filter(account_id__in=account_ids).delete()
@@ -0,0 +1,71 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+from django.utils import timezone
+
+from account.models import Account
+from gluu_ecommerce.utils import get_last_month
+from gluu_license.models import License
+from payment import constants
+from payment.models import BillingCheckpoint, BillingRun, Payment
+from payment.runs import filter_shard, shard_label
+
+
+class Command(BaseCommand):
+
+    help = 'Report the completion of every shard of the monthly billing commands'
+
+    def add_arguments(self, parser):
+
+        parser.add_argument('--shards', type=int, default=1, help='Number of shards the run uses')
+        parser.add_argument('--month', type=int)
+        parser.add_argument('--year', type=int)
+
+    def handle(self, *args, **options):
+
+        month, year = get_last_month()
+        month = options['month'] or month
+        year = options['year'] or year
+
+        count = options['shards']
+        today = timezone.now().replace(hour=0, minute=0, second=0, microsecond=0)
+
+        self.stdout.write('Billing {}/{} over {} shards'.format(month, year, count))
+
+        for index in range(count):
+
+            shard = (index, count) if count > 1 else None
+            label = shard_label(shard) or 'all'
+
+            self.stdout.write('Shard {}'.format(label))
+
+            licenses = filter_shard(License.objects.all(), shard, 'account')
+            synced = licenses.filter(last_synced__gte=today).count()
+
+            self.stdout.write('  sync_license_server     {}/{} licenses synced today'.format(
+                synced, licenses.count()))
+
+            accounts = filter_shard(Account.objects.filter(payment_on_platform=True), shard)
+            run = BillingRun.objects.filter(
+                command='monthly_summary', month=month, year=year, shard=shard_label(shard)).first()
+
+            if run is None:
+                self.stdout.write('  monthly_summary         not started')
+
+            else:
+                checkpoints = BillingCheckpoint.objects.filter(run=run)
+                finished = checkpoints.filter(
+                    status__in=[constants.CHECKPOINT_DONE, constants.CHECKPOINT_SKIPPED]).count()
+                failed = checkpoints.filter(status=constants.CHECKPOINT_FAILED).count()
+
+                self.stdout.write('  monthly_summary         {}/{} accounts, {} failed{}'.format(
+                    finished, accounts.count(), failed, ', finished' if run.finished else ''))
+
+            payments = filter_shard(Payment.objects.filter(month=month, year=year), shard, 'account')
+            pending = payments.filter(status=constants.INITIATED).count()
+            retries = payments.filter(status=constants.FAILED, charge_attempts__lt=2).count()
+            leased = payments.filter(lease_until__gt=timezone.now()).filter(
+                Q(status=constants.INITIATED) | Q(status=constants.FAILED)).count()
+
+            self.stdout.write('  monthly_charging        {}/{} payments charged, {} in progress'.format(
+                payments.count() - pending, payments.count(), leased))
+            self.stdout.write('  monthly_charging_retry  {} payments left to retry'.format(retries))
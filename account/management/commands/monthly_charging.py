@@ -3,67 +3,109 @@ import stripe
 
 from django.core.management.base import BaseCommand
 from django.core.exceptions import ObjectDoesNotExist
-from django.conf import settings
+
+from gluu_ecommerce.utils import parse_shard
 
 from account import constants
 from account.utils import send_billing_email, send_charging_failed_email
 
+from payment import charging
+from payment.cards import primary_card_last4
 from payment.models import Payment
+from payment.runs import filter_shard
 from payment.constants import INITIATED, PAID, FAILED
 
-stripe.api_key = settings.STRIPE_API_KEY
-
 logger = logging.getLogger('billing')
 
 
-class Command(BaseCommand):
+def charge_payment(payment_id):
 
-    def handle(self, *args, **options):
+    payment = Payment.objects.select_related('account').get(pk=payment_id)
+    account = payment.account
+
+    # Payments released by a failed attempt are replayed
+    replayed = payment.charge_attempts > 0
+    payment.charge_attempts = 1
+
+    try:
+
+        logger.info('Running monthly payment for {}'.format(account.get_name()))
+
+        outcome = charging.NOTHING_DUE
+
+        if payment.paid_amount > 0:
 
-        payments = Payment.objects.filter(status=INITIATED)
+            response = charging.charge_invoice(
+                'charge',
+                payment,
+                replayed,
+                amount=int(payment.paid_amount * 100),
+                currency='USD',
+                customer=account.stripe.customer_id,
+                description=constants.CHARGE_DESCIRPTION.format(account.get_name()),
+                metadata={'invoice_id': payment.invoice_id}
+            )
 
-        for payment in payments:
+            payment.stripe_reference = response.id
+            send_billing_email(payment)
 
-            try:
+            outcome = charging.CHARGED
 
-                account = payment.account
+        payment.status = PAID
+        payment.save()
 
-                logger.info('Running monthly payment for {}'.format(account.get_name()))
+        logger.info('Payment successful')
 
-                if payment.paid_amount > 0:
+        return outcome
 
-                    response = stripe.Charge.create(
-                        amount=int(payment.paid_amount * 100),
-                        currency='USD',
-                        customer=account.stripe.customer_id,
-                        description=constants.CHARGE_DESCIRPTION.format(account.get_name())
-                    )
+    except ObjectDoesNotExist as e:
 
-                    payment.stripe_reference = response.id
-                    send_billing_email(payment)
+        payment.status = FAILED
+        charging.release(payment, 'status', 'charge_attempts')
+        logger.error('No card attached to account {}, {}'.format(account, e))
 
-                payment.status = PAID
-                payment.save()
+        return charging.NO_CARD
 
-                logger.info('Payment successful')
+    except stripe.error.CardError as e:
 
-            except ObjectDoesNotExist as e:
+        # Released so the retry run can claim it right away
+        payment.status = FAILED
+        charging.release(payment, 'status', 'charge_attempts')
 
-                payment.status = FAILED
-                payment.save()
-                logger.error('No card attached to account {}, {}'.format(account, e))
+        send_charging_failed_email(payment, primary_card_last4(account))
+        logger.error('Card has been declined: account {}, {}'.format(account, e))
 
-            except (stripe.error.CardError, stripe.error.StripeError) as e:
+        return charging.DECLINED
 
-                payment.status = FAILED
-                payment.save()
+    except stripe.error.StripeError as e:
 
-                customer = stripe.Customer.retrieve(account.stripe.customer_id)
-                card_details = customer.sources.retrieve(customer.default_source)
+        # The charge may have gone through before the error. The payment
+        # stays INITIATED, the next run replays the same idempotency key
+        # instead of the retry run charging it under a new one.
+        charging.release(payment, 'charge_attempts')
+        logger.error('Charging failed: account {}, {}'.format(account, e))
+
+        return charging.ERROR
+
+
+class Command(BaseCommand):
+
+    def add_arguments(self, parser):
+
+        parser.add_argument('--workers', type=int, help='Payments charged concurrently')
+        parser.add_argument('--batch-size', type=int, help='Payments claimed at a time')
+        parser.add_argument('--shard', type=parse_shard,
+                            help='INDEX/COUNT, only process the accounts of this shard')
+
+    def handle(self, *args, **options):
 
-                send_charging_failed_email(payment, card_details.last4)
-                logger.error('Card has been declined: account {}, {}'.format(account, e))
+        # Any number of these commands can run at once, each claims its own
+        # batches of payments
+        outcomes = charging.drain(
+            filter_shard(Payment.objects.filter(status=INITIATED), options['shard'], 'account'),
+            charge_payment,
+            options['workers'],
+            options['batch_size']
+        )
 
-            except Exception as e:
-                logger.exception(e)
-                logger.error('Billing failed: account {}, {}'.format(account, e))
+        return ', '.join('{} {}'.format(count, outcome) for outcome, count in sorted(outcomes.items()))
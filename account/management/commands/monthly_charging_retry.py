@@ -3,74 +3,120 @@ import stripe
 
 from django.core.management.base import BaseCommand
 from django.core.exceptions import ObjectDoesNotExist
-from django.conf import settings
 
-from gluu_ecommerce.utils import get_last_month
+from gluu_ecommerce.utils import get_last_month, parse_shard
 
 from account import constants
 from account.utils import send_billing_email, send_license_deactivated_email
 
+from payment import charging
+from payment.cards import primary_card_last4
 from payment.models import Payment
+from payment.runs import filter_shard
 from payment.constants import PAID, FAILED
 
 from gluu_license.connectors.license_interface import update_license_status
 
-stripe.api_key = settings.STRIPE_API_KEY
-
 logger = logging.getLogger('billing')
 
 
-class Command(BaseCommand):
+def retry_payment(payment_id):
 
-    def handle(self, *args, **options):
+    payment = Payment.objects.select_related('account').get(pk=payment_id)
+    account = payment.account
+    payment.charge_attempts = 2
 
-        month, year = get_last_month()
-        payments = Payment.objects.filter(status=FAILED, month=month, year=year)
+    try:
+
+        logger.info('Running second charging attempt for payment for {}'.format(account.get_name()))
+
+        outcome = charging.NOTHING_DUE
+
+        if payment.paid_amount > 0:
+
+            # A separate key, the first attempt's key would replay its
+            # decline. An earlier retry run may have charged the payment
+            # before failing, so retries always look for its charge first.
+            response = charging.charge_invoice(
+                'charge-retry',
+                payment,
+                True,
+                amount=int(payment.paid_amount * 100),
+                currency='USD',
+                customer=account.stripe.customer_id,
+                description=constants.CHARGE_DESCIRPTION.format(account.get_name()),
+                metadata={'invoice_id': payment.invoice_id}
+            )
+
+            payment.stripe_reference = response.id
+
+            outcome = charging.CHARGED
 
-        for payment in payments:
+        payment.status = PAID
+        payment.save()
 
-            try:
+        logger.info('Payment successful')
+        send_billing_email(payment)
 
-                account = payment.account
+        return outcome
 
-                logger.info('Running second charging attempt for payment for {}'.format(account.get_name()))
+    except ObjectDoesNotExist as e:
 
-                if payment.paid_amount > 0:
+        payment.status = FAILED
+        payment.save()
+        logger.error('No card attached to account {}, {}'.format(account, e))
 
-                    response = stripe.Charge.create(
-                        amount=int(payment.paid_amount * 100),
-                        
-                        currency='USD',
-                        customer=account.stripe.customer_id,
-                        description=constants.CHARGE_DESCIRPTION.format(account.get_name())
-                    )
+        return charging.NO_CARD
 
-                    payment.stripe_reference = response.id
+    except stripe.error.CardError as e:
 
-                payment.status = PAID
-                payment.save()
+        # Keeps the payment from being claimed by a later retry run
+        charging.release(payment, 'charge_attempts')
 
-                logger.info('Payment successful')
-                send_billing_email(payment)
+        account.license.is_active = False
+        account.license.is_blocked = True
+        update_license_status(account.license)
+        account.license.save()
 
-            except ObjectDoesNotExist as e:
+        send_license_deactivated_email(payment, primary_card_last4(account))
+        logger.error('Card has been declined: account {}, {}'.format(account, e))
 
-                payment.status = FAILED
-                payment.save()
-                logger.error('No card attached to account {}, {}'.format(account, e))
+        return charging.DECLINED
 
-            except (stripe.error.CardError, stripe.error.StripeError) as e:
+    except stripe.error.StripeError as e:
 
-                customer = stripe.Customer.retrieve(account.stripe.customer_id)
-                card_details = customer.sources.retrieve(customer.default_source)
-                account.license.is_active = False
-                account.license.is_blocked = True
-                update_license_status(account.license)
-                account.license.save()
+        # The charge may have gone through. The license is left alone and
+        # the next retry run replays the same idempotency key.
+        charging.release(payment)
+        logger.error('Charging failed: account {}, {}'.format(account, e))
 
-                send_license_deactivated_email(payment, card_details.last4)
-                logger.error('Card has been declined: account {}, {}'.format(account, e))
+        return charging.ERROR
+
+
+class Command(BaseCommand):
+
+    def add_arguments(self, parser):
+
+        parser.add_argument('--workers', type=int, help='Payments charged concurrently')
+        parser.add_argument('--batch-size', type=int, help='Payments claimed at a time')
+        parser.add_argument('--shard', type=parse_shard,
+                            help='INDEX/COUNT, only process the accounts of this shard')
+
+    def handle(self, *args, **options):
+
+        month, year = get_last_month()
 
-            except Exception as e:
-                logger.exception(e)
-                logger.error('Billing failed: account {}, {}'.format(account, e))
+        # Payments declined again keep their FAILED status, the attempt count
+        # keeps them from being claimed a second time
+        outcomes = charging.drain(
+            filter_shard(
+                Payment.objects.filter(status=FAILED, month=month, year=year, charge_attempts__lt=2),
+                options['shard'],
+                'account'
+            ),
+            retry_payment,
+            options['workers'],
+            options['batch_size']
+        )
+
+        return ', '.join('{} {}'.format(count, outcome) for outcome, count in sorted(outcomes.items()))
@@ -1,97 +1,161 @@
 import logging
-import stripe
 from random import randint
 
 from django.core.management.base import BaseCommand
-from django.core.exceptions import ObjectDoesNotExist
 from django.conf import settings
+from django.db import transaction
 from django.utils import timezone
 
-from account.models import Account
+from account.models import Account, Credit
 from account.utils import send_summary_email
 
-from payment.models import Payment, StripeCustomer
+from payment import constants
+from payment.cards import primary_card_last4
+from payment.invoicing import generate_invoices
+from payment.models import Payment, StripeCard
+from payment.runs import checkpoint, execute_run, filter_shard, start_run
 
-from gluu_ecommerce.utils import get_last_month
+from gluu_ecommerce.utils import get_last_month, parse_shard
 
 from gluu_license.models import LicenseRecord
 from gluu_license.connectors.license_interface import sync_usage_records
 
-stripe.api_key = settings.STRIPE_API_KEY
-
 logger = logging.getLogger('billing')
 
 
-class Command(BaseCommand):
+def summarize_account(run_id, account_id, month, year):
 
-    def handle(self, *args, **options):
+    account = Account.objects.get(pk=account_id)
 
-        accounts = Account.objects.filter(payment_on_platform=True)
+    logger.info('Next account {} ({}).'.format(account.id, account.get_name()))
 
-        month, year = get_last_month()
+    sync_usage_records(account.license)
+
+    record = LicenseRecord.objects.get(
+        license=account.license,
+        month=month,
+        year=year
+    )
+
+    logger.info('Last month\'s charge {}'.format(record.total_usd))
+
+    details = {}
+    for mac, count in record.installations.values_list('mac', 'count'):
+        details[mac] = [count, count * settings.PRICE_PER_LICENSE]
+
+    # The payment, the credit it uses and the checkpoint are committed
+    # together, a resumed run never bills the account twice
+    with transaction.atomic():
+
+        # Runs of another shard layout don't share checkpoints with this
+        # one, the payment itself shows the account was billed. The account
+        # lock keeps two runs from billing it at the same time.
+        Account.objects.select_for_update().get(pk=account.pk)
+
+        if Payment.objects.filter(account=account, month=month, year=year).exists():
+
+            logger.info('Account {} is already billed for {}/{}'.format(account.id, month, year))
+            checkpoint(run_id, account_id, constants.CHECKPOINT_DONE)
+
+            return
+
+        payment = Payment(
+            invoice_id=randint(100000000, 999999999),
+            account=account,
+            amount=record.total_usd,
+            details=details,
+            month=month,
+            year=year
+        )
+
+        credits = Credit.objects.select_for_update().filter(
+            account=account,
+            expires__gt=timezone.now(),
+            remaining_amount__gt=0.00
+        )
 
-        for account in accounts:
+        # For now, we only support one valid credit object at a time
+        if len(credits) == 1:
 
-            try:
-                logger.info('Next account {} ({}).'.format(account.id, account.get_name()))
+            credit = credits[0]
 
-                sync_usage_records(account.license)
+            if credit.remaining_amount > record.total_usd:
+                payment.credits_used = record.total_usd
+                credit.remaining_amount = credit.remaining_amount - record.total_usd
 
-                record = LicenseRecord.objects.get(
-                    license=account.license,
-                    month=month,
-                    year=year
-                )
+            else:  # credit.remaining_amount <= self.balance:
+                payment.credits_used = credit.remaining_amount
+                credit.remaining_amount = 0.00
 
-                logger.info('Last month\'s charge {}'.format(record.total_usd))
+            credit.save()
 
-                details = {}
-                for mac, count in record.details.iteritems():
-                    details[mac] = [count, count * settings.PRICE_PER_LICENSE]
+        payment.save()
 
-                payment = Payment(
-                    invoice_id=randint(100000000, 999999999),
-                    account=account,
-                    amount=record.total_usd,
-                    details=details,
-                    month=month,
-                    year=year
-                )
+        checkpoint(run_id, account_id, constants.CHECKPOINT_DONE)
 
-                credits = account.credits.filter(
-                    expires__gt=timezone.now(),
-                    remaining_amount__gt=0.00
-                )
+    # The account is billed at this point, a failing notification must not
+    # mark it as failed and have it billed again on resume
+    try:
 
-                # For now, we only support one valid credit object at a time
-                if len(credits) == 1:
+        send_summary_email(payment, record, primary_card_last4(account))
 
-                    credit = credits[0]
+    except Exception as e:
+        logger.exception('Failed to send the summary of payment {}: {}'.format(payment.invoice_id, e))
 
-                    if credit.remaining_amount > record.total_usd:
-                        payment.credits_used = record.total_usd
-                        credit.remaining_amount = credit.remaining_amount - record.total_usd
 
-                    else:  # credit.remaining_amount <= self.balance:
-                        payment.credits_used = credit.remaining_amount
-                        credit.remaining_amount = 0.00
+def send_summaries(invoices):
 
-                    credit.save()
+    last4 = dict(StripeCard.objects.filter(
+        customer__account__in=[payment.account_id for payment, record in invoices],
+        is_primary=True
+    ).values_list('customer__account', 'last4'))
+
+    for payment, record in invoices:
+
+        try:
+
+            send_summary_email(payment, record, last4.get(payment.account_id))
+
+        except Exception as e:
+            logger.exception('Failed to send the summary of payment {}: {}'.format(payment.invoice_id, e))
+
+
+class Command(BaseCommand):
+
+    def add_arguments(self, parser):
+
+        parser.add_argument('--workers', type=int, default=1, help='Accounts billed concurrently')
+        parser.add_argument('--shard', type=parse_shard,
+                            help='INDEX/COUNT, only process the accounts of this shard')
+        parser.add_argument('--bulk', action='store_true',
+                            help='Generate the invoices a batch of accounts at a time from the stored '
+                                 'license records, run sync_license_server first')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Accounts per batch with --bulk')
+
+    def handle(self, *args, **options):
+
+        accounts = filter_shard(Account.objects.filter(payment_on_platform=True), options['shard'])
+
+        month, year = get_last_month()
 
-                payment.save()
+        run = start_run('monthly_summary', month, year, options['shard'])
 
-                if len(StripeCustomer.objects.filter(account=account)) == 1:
+        if options['bulk']:
 
-                    customer = stripe.Customer.retrieve(account.stripe.customer_id)
-                    card_details = customer.sources.retrieve(customer.default_source)
-                    send_summary_email(payment, record, card_details.last4)
+            results = generate_invoices(
+                run, accounts, month, year, options['batch_size'], notify=send_summaries)
 
-                else:
-                    send_summary_email(payment, record)
+        else:
 
-            except ObjectDoesNotExist as e:
-                logger.info('No license record found for account {}, {}'.format(account, e))
+            results = execute_run(
+                run,
+                accounts,
+                lambda run_id, account_id: summarize_account(run_id, account_id, month, year),
+                options['workers']
+            )
 
-            except Exception as e:
-                logger.exception(e)
-                logger.error('Billing failed: account {}, {}'.format(account, e))
+        return 'Billed {}, skipped {}, failed {} accounts'.format(
+            results[constants.CHECKPOINT_DONE],
+            results[constants.CHECKPOINT_SKIPPED],
+            results[constants.CHECKPOINT_FAILED]
+        )
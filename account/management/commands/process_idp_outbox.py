@@ -0,0 +1,38 @@
+import logging
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from account.outbox import process_outbox
+
+logger = logging.getLogger('idp')
+
+
+class Command(BaseCommand):
+
+    help = 'Deliver pending SCIM writes to the idp'
+
+    def add_arguments(self, parser):
+
+        parser.add_argument('--batch-size', type=int, default=settings.IDP_OUTBOX_BATCH_SIZE)
+        parser.add_argument('--loop', action='store_true', help='Keep polling for new entries')
+        parser.add_argument('--interval', type=float, default=2.0, help='Seconds between polls')
+
+    def handle(self, *args, **options):
+
+        while True:
+
+            try:
+                processed = process_outbox(options['batch_size'])
+
+            except Exception as e:
+                logger.exception(e)
+                processed = 0
+
+            if not options['loop']:
+                return 'Processed {} entries'.format(processed)
+
+            # Drain a backlog without pausing, poll once it is empty
+            if processed < options['batch_size']:
+                time.sleep(options['interval'])
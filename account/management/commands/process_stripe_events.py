@@ -0,0 +1,37 @@
+import logging
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from payment.webhooks import process_events
+
+logger = logging.getLogger('billing')
+
+
+class Command(BaseCommand):
+
+    help = 'Apply pending Stripe webhook events, including retries and events left by crashed workers'
+
+    def add_arguments(self, parser):
+
+        parser.add_argument('--batch-size', type=int, default=settings.STRIPE_EVENT_BATCH_SIZE)
+        parser.add_argument('--loop', action='store_true', help='Keep polling for new events')
+        parser.add_argument('--interval', type=float, default=5.0, help='Seconds between polls')
+
+    def handle(self, *args, **options):
+
+        while True:
+
+            try:
+                processed = process_events(options['batch_size'])
+
+            except Exception as e:
+                logger.exception(e)
+                processed = 0
+
+            if not options['loop']:
+                return 'Processed {} events'.format(processed)
+
+            if processed < options['batch_size']:
+                time.sleep(options['interval'])
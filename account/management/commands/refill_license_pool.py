@@ -0,0 +1,37 @@
+import logging
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from gluu_license.pool import refill_pool
+
+logger = logging.getLogger('django')
+
+
+class Command(BaseCommand):
+
+    help = 'Acquire licenses ahead of time once the pool runs low'
+
+    def add_arguments(self, parser):
+
+        parser.add_argument('--low-watermark', type=int, default=settings.LICENSE_POOL_LOW_WATERMARK)
+        parser.add_argument('--size', type=int, default=settings.LICENSE_POOL_SIZE)
+        parser.add_argument('--loop', action='store_true', help='Keep checking the pool')
+        parser.add_argument('--interval', type=float, default=60.0, help='Seconds between checks')
+
+    def handle(self, *args, **options):
+
+        while True:
+
+            try:
+                acquired = refill_pool(options['low_watermark'], options['size'])
+
+            except Exception as e:
+                logger.exception(e)
+                acquired = 0
+
+            if not options['loop']:
+                return 'Acquired {} licenses'.format(acquired)
+
+            time.sleep(options['interval'])
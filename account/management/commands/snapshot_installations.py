@@ -0,0 +1,46 @@
+import logging
+import time
+
+from multiprocessing.pool import ThreadPool
+
+from django.core.management.base import BaseCommand
+
+from gluu_license.models import License
+from gluu_license.snapshots import downsample, rollup_recent, take_snapshot
+
+logger = logging.getLogger('django')
+
+
+class Command(BaseCommand):
+
+    help = 'Snapshot active installations of every license, roll up and downsample history'
+
+    def add_arguments(self, parser):
+
+        parser.add_argument('--workers', type=int, default=1, help='Licenses snapshotted concurrently')
+        parser.add_argument('--no-rollup', action='store_true',
+                            help='Only take the hourly snapshots')
+
+    def handle(self, *args, **options):
+
+        license_ids = list(License.objects.filter(is_active=True).values_list('pk', flat=True))
+
+        start = time.time()
+        pool = ThreadPool(max(options['workers'], 1))
+
+        try:
+            taken = sum(pool.imap_unordered(take_snapshot, license_ids))
+
+        finally:
+            pool.close()
+            pool.join()
+
+        self.stdout.write('Snapshotted {}/{} licenses in {:.1f}s'.format(
+            taken, len(license_ids), time.time() - start))
+
+        if not options['no_rollup']:
+
+            rollup_recent()
+            downsample()
+
+            self.stdout.write('Rolled up and downsampled snapshots')
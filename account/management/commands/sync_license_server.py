@@ -1,26 +1,123 @@
+import datetime
 import logging
+import time
 
+from multiprocessing.pool import ThreadPool
+
+from django.conf import settings
 from django.core.management.base import BaseCommand
+from django.db import connection
+from django.db.models import Q
+from django.utils import timezone
 
 from account.models import Account
-from gluu_license.connectors.license_interface import sync_usage_records
+from gluu_ecommerce.utils import parse_shard, percentile
+from payment.runs import filter_shard
+from gluu_license.connectors.license_interface import retrieve_usage_records, sync_usage_records
 from django.core.exceptions import ObjectDoesNotExist
 
 logger = logging.getLogger('billing')
 
+
+def sync_account(account_id):
+
+    # Runs in a worker thread with its own database connection. Errors are
+    # contained to the account so one bad license does not stop the run.
+    # Returns (account id, upstream latency, error).
+
+    latency = None
+
+    try:
+
+        account = Account.objects.select_related('license').get(pk=account_id)
+        license = account.license
+
+        start = time.time()
+        raw_usage_records = retrieve_usage_records(license.license_id)
+        latency = time.time() - start
+
+        if not raw_usage_records:
+            return account_id, latency, 'No usage records returned'
+
+        sync_usage_records(license, raw_usage_records)
+
+        return account_id, latency, None
+
+    except ObjectDoesNotExist:
+
+        logger.error('Failed to sync usage records for account: {}'.format(account_id))
+        return account_id, latency, 'Account has no license'
+
+    except Exception as e:
+
+        logger.exception('Failed to sync usage records for account {}: {}'.format(account_id, e))
+        return account_id, latency, str(e)
+
+    finally:
+        connection.close()
+
+
 class Command(BaseCommand):
 
+    help = 'Sync usage records of every account with the license server'
+
+    def add_arguments(self, parser):
+
+        parser.add_argument('--workers', type=int, default=1, help='Accounts synced concurrently')
+        parser.add_argument('--progress', type=int, default=100,
+                            help='Report progress every N accounts, 0 to turn it off')
+        parser.add_argument('--shard', type=parse_shard,
+                            help='INDEX/COUNT, only process the accounts of this shard')
+        parser.add_argument('--stale-only', action='store_true',
+                            help='Skip licenses synced within USAGE_SYNC_FRESHNESS, for restarts')
 
     def handle(self, *args, **options):
 
-        accounts = Account.objects.all()
+        accounts = filter_shard(Account.objects.all(), options['shard'])
+
+        if options['stale_only']:
+            fresh = timezone.now() - datetime.timedelta(seconds=settings.USAGE_SYNC_FRESHNESS)
+            accounts = accounts.filter(
+                Q(license__last_synced__isnull=True) | Q(license__last_synced__lt=fresh))
+
+        account_ids = list(accounts.values_list('pk', flat=True))
+        total = len(account_ids)
+
+        latencies = []
+        failures = []
+
+        start = time.time()
+        pool = ThreadPool(max(options['workers'], 1))
+
+        try:
+
+            results = pool.imap_unordered(sync_account, account_ids)
+
+            for done, (account_id, latency, error) in enumerate(results, 1):
+
+                if latency is not None:
+                    latencies.append(latency)
+
+                if error:
+                    failures.append((account_id, error))
+
+                if options['progress'] > 0 and (done % options['progress'] == 0 or done == total):
+                    self.stdout.write('{}/{} accounts synced, {} failed'.format(
+                        done, total, len(failures)))
 
-        for account in accounts:
+        finally:
+            pool.close()
+            pool.join()
 
-            try:
+        elapsed = time.time() - start
 
-                sync_usage_records(account.license)
+        self.stdout.write('Synced {} accounts in {:.1f}s ({:.2f} accounts/s), {} failed'.format(
+            total, elapsed, total / elapsed if elapsed else 0, len(failures)))
 
-            except ObjectDoesNotExist:
+        if latencies:
+            self.stdout.write('Upstream latency p50 {:.3f}s, p90 {:.3f}s, p99 {:.3f}s, max {:.3f}s'.format(
+                percentile(latencies, 50), percentile(latencies, 90),
+                percentile(latencies, 99), max(latencies)))
 
-                logger.error('Failed to sync usage records for account: {}'.format(account))
+        for account_id, error in failures:
+            self.stdout.write('Account {}: {}'.format(account_id, error))
@@ -0,0 +1,24 @@
+import logging
+
+from django.core.management.base import BaseCommand
+
+from account.connectors.idp_interface import sync_users
+
+logger = logging.getLogger('idp')
+
+
+class Command(BaseCommand):
+
+    help = 'Mirror SCIM users modified since the last run'
+
+    def add_arguments(self, parser):
+
+        parser.add_argument('--full', action='store_true', help='Mirror every SCIM user')
+
+    def handle(self, *args, **options):
+
+        count = sync_users(full=options['full'])
+
+        logger.info('Mirrored {} SCIM users'.format(count))
+
+        return 'Mirrored {} users'.format(count)
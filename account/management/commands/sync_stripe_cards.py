@@ -0,0 +1,55 @@
+import logging
+import stripe
+
+from django.core.management.base import BaseCommand
+
+from payment import gateway
+from payment.cards import store_cards, sync_cards
+from payment.models import StripeCustomer
+
+logger = logging.getLogger('billing')
+
+
+class Command(BaseCommand):
+
+    help = 'Copy the cards of every Stripe customer into the local card mirror'
+
+    def add_arguments(self, parser):
+
+        parser.add_argument('--customer', help='Only sync the cards of this Stripe customer id')
+
+    def handle(self, *args, **options):
+
+        if options['customer']:
+
+            sync_cards(StripeCustomer.objects.get(customer_id=options['customer']))
+
+            return 'Synced cards of customer {}'.format(options['customer'])
+
+        # Customers are listed page by page instead of retrieved one by one
+        stripe_customers = dict(
+            (stripe_customer.customer_id, stripe_customer)
+            for stripe_customer in StripeCustomer.objects.all()
+        )
+
+        synced = 0
+
+        for customer in gateway.iter_customers():
+
+            stripe_customer = stripe_customers.get(customer.id)
+
+            if stripe_customer is None:
+                continue
+
+            try:
+                store_cards(stripe_customer, customer)
+                synced += 1
+
+            except stripe.error.StripeError as e:
+                logger.error('Failed to sync cards of customer {}: {}'.format(customer.id, e))
+
+        for call, latency in sorted(gateway.latencies.summary().items()):
+            self.stdout.write('{}: {} calls, p50 {:.3f}s, p99 {:.3f}s'.format(
+                call, latency['count'], latency['p50'], latency['p99']))
+
+        return 'Synced cards of {} of {} customers'.format(synced, len(stripe_customers))
@@ -1,19 +1,22 @@
 from django.core.management.base import BaseCommand
 
-from account.connectors.idp_interface import email_exists
+from account.connectors.idp_interface import emails_exist
 
 
 class Command(BaseCommand):
 
     def add_arguments(self, parser):
 
-        parser.add_argument('-email', required=True)
+        parser.add_argument('-email', required=True, nargs='+')
 
     def handle(self, *args, **options):
 
-        email = options['email']
+        emails = options['email']
 
-        if email_exists(email):
-            return 'Found'
+        existing = emails_exist(emails)
 
-        return 'Not found'
+        if len(emails) == 1:
+            return 'Found' if existing[emails[0]] else 'Not found'
+
+        return '\n'.join(
+            '{}: {}'.format(email, 'Found' if existing[email] else 'Not found') for email in emails)
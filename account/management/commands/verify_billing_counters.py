@@ -0,0 +1,42 @@
+from django.core.management.base import BaseCommand
+
+from account.counters import compute
+from account.models import BillingCounters
+
+FIELDS = ('installations', 'billed', 'paid', 'credit')
+
+
+class Command(BaseCommand):
+
+    help = 'Recount the stored billing counters of every account and report drift'
+
+    def add_arguments(self, parser):
+
+        parser.add_argument('--fix', action='store_true', help='Store the recounted values')
+
+    def handle(self, *args, **options):
+
+        drifted = 0
+        counters = BillingCounters.objects.select_related('account').order_by('account')
+
+        for stored in counters.iterator():
+
+            values = compute(stored.account_id)
+
+            drift = [
+                '{} {} != {}'.format(field, getattr(stored, field), values[field])
+                for field in FIELDS
+                if abs(getattr(stored, field) - values[field]) > 0.005
+            ]
+
+            if not drift:
+                continue
+
+            drifted += 1
+            self.stdout.write('Account {} ({}): {}'.format(
+                stored.account_id, stored.account.get_name(), ', '.join(drift)))
+
+            if options['fix']:
+                BillingCounters.objects.filter(pk=stored.pk).update(**values)
+
+        return '{} accounts drifted{}'.format(drifted, ', fixed' if options['fix'] and drifted else '')
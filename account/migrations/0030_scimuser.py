@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.2 on 2026-10-18 09:12
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import jsonfield.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('account', '0029_ecommerceuser_idp_uuid'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ScimUser',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('idp_uuid', models.CharField(max_length=255, unique=True)),
+                ('email', models.EmailField(blank=True, db_index=True, max_length=255)),
+                ('phone_number', models.CharField(blank=True, max_length=30)),
+                ('active', models.BooleanField(default=False)),
+                ('attributes', jsonfield.fields.JSONField(default=dict)),
+                ('last_modified', models.DateTimeField(blank=True, db_index=True, null=True)),
+                ('synced', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
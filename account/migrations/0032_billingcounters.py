@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.2 on 2026-10-18 16:02
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('account', '0031_idpoutbox'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BillingCounters',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('installations', models.IntegerField(default=0)),
+                ('billed', models.FloatField(default=0.0)),
+                ('paid', models.FloatField(default=0.0)),
+                ('credit', models.FloatField(default=0.0)),
+                ('credit_expires', models.DateTimeField(blank=True, null=True)),
+                ('updated', models.DateTimeField(auto_now=True)),
+                ('account', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='counters', to='account.Account')),
+            ],
+        ),
+    ]
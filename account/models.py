@@ -1,5 +1,7 @@
 from __future__ import unicode_literals
 
+import jsonfield
+
 from django.conf import settings
 from django.db import models
 from django.contrib.auth.models import BaseUserManager, AbstractBaseUser
@@ -10,6 +12,8 @@ from django_countries.fields import CountryField
 
 from localflavor.us.models import USStateField, USZipCodeField
 
+from account import constants
+
 
 class Account(models.Model):
 
@@ -63,52 +67,44 @@ class Account(models.Model):
             return 'Business'
         return 'Individual'
 
-    @property
-    def balance(self):
+    def get_counters(self):
 
         try:
-            no_licenses = self.license.records.aggregate(
-                models.Sum('number_licenses'))['number_licenses__sum']
-        except ObjectDoesNotExist:
-            pass
+            return self.counters
 
-        try:
-            paid = self.payments.filter(status='PAID').aggregate(
-                models.Sum('amount'))['amount__sum']
         except ObjectDoesNotExist:
-            pass
 
-        if not no_licenses:
-            no_licenses = 0
+            from account.counters import create_counters
 
-        if not paid:
-            paid = 0.0
+            self.counters = create_counters(self)
+            return self.counters
 
-        return (no_licenses * settings.PRICE_PER_LICENSE) - paid
+    @property
+    def balance(self):
+
+        counters = self.get_counters()
+
+        return (counters.installations * settings.PRICE_PER_LICENSE) - counters.paid
 
     @property
     def remaining_credits(self):
 
-        remaining_amount = Credit.objects.filter(
-            account=self,
-            expires__gt=timezone.now(),
-            remaining_amount__gt=0.00
-        ).aggregate(models.Sum('remaining_amount'))['remaining_amount__sum']
+        counters = self.get_counters()
+
+        # Credits expire without a write, the stored sum is recounted once
+        # the earliest of them has passed
+        if counters.credit_expires and counters.credit_expires <= timezone.now():
 
-        if not remaining_amount:
-            return 0.00
+            from account.counters import recount_credit
 
-        return remaining_amount
+            recount_credit(self.pk)
+            counters.refresh_from_db()
+
+        return counters.credit
 
     @property
     def number_installations(self):
-
-        try:
-            if self.license.records.all():
-                return self.license.records.aggregate(models.Sum('number_licenses'))['number_licenses__sum']
-        except ObjectDoesNotExist:
-            pass
-        return 0
+        return self.get_counters().installations
 
 
 class EcommerceUserManager(BaseUserManager):
@@ -307,3 +303,124 @@ class PremiumInvitation(models.Model):
         'created',
         auto_now_add=True
     )
+
+
+class ScimUser(models.Model):
+
+    # Local copy of the SCIM attributes read from the idp, refreshed by the
+    # sync_scim_users command
+
+    idp_uuid = models.CharField(
+        max_length=255,
+        unique=True
+    )
+
+    email = models.EmailField(
+        max_length=255,
+        blank=True,
+        db_index=True
+    )
+
+    phone_number = models.CharField(
+        max_length=30,
+        blank=True
+    )
+
+    active = models.BooleanField(default=False)
+
+    attributes = jsonfield.JSONField()
+
+    last_modified = models.DateTimeField(
+        null=True,
+        blank=True,
+        db_index=True
+    )
+
+    synced = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return self.email or self.idp_uuid
+
+
+class ScimSync(models.Model):
+
+    # Completed runs of sync_scim_users. The start of the latest one is the
+    # watermark of the next incremental sync.
+
+    started = models.DateTimeField(db_index=True)
+
+    finished = models.DateTimeField(auto_now_add=True)
+
+    full = models.BooleanField(default=False)
+
+    count = models.IntegerField(default=0)
+
+
+class IdpOutbox(models.Model):
+
+    # Pending SCIM writes, saved in the same transaction as the local user and
+    # delivered by the process_idp_outbox command
+
+    user = models.ForeignKey(
+        EcommerceUser,
+        related_name='idp_operations'
+    )
+
+    operation = models.CharField(
+        max_length=10,
+        choices=constants.IDP_OPERATION_CHOICES
+    )
+
+    # Encrypted password of users still to be created, cleared once delivered
+    secret = models.TextField(blank=True)
+
+    active = models.BooleanField(default=False)
+
+    status = models.CharField(
+        max_length=4,
+        choices=constants.OUTBOX_STATUS_CHOICES,
+        default=constants.OUTBOX_PENDING
+    )
+
+    attempts = models.IntegerField(default=0)
+
+    next_attempt = models.DateTimeField(default=timezone.now)
+
+    last_error = models.TextField(blank=True)
+
+    created = models.DateTimeField(auto_now_add=True)
+
+    processed = models.DateTimeField(
+        null=True,
+        blank=True
+    )
+
+    class Meta:
+        index_together = [('status', 'next_attempt')]
+
+
+class BillingCounters(models.Model):
+
+    # Aggregates of the account's license records, payments and credits,
+    # recounted by account.counters whenever one of those rows is written
+
+    account = models.OneToOneField(
+        Account,
+        related_name='counters'
+    )
+
+    installations = models.IntegerField(default=0)
+
+    billed = models.FloatField(default=0.00)
+
+    paid = models.FloatField(default=0.00)
+
+    credit = models.FloatField(default=0.00)
+
+    # Earliest expiry among the credits counted in credit
+    credit_expires = models.DateTimeField(
+        null=True,
+        blank=True
+    )
+
+    updated = models.DateTimeField(auto_now=True)
@@ -0,0 +1,252 @@
+import base64
+import datetime
+import logging
+
+from hashlib import sha256
+
+from cryptography.fernet import Fernet
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from account import constants
+from account.connectors import idp_interface as idp
+from account.models import IdpOutbox
+
+logger = logging.getLogger('idp')
+
+
+def get_fernet():
+
+    key = base64.urlsafe_b64encode(sha256(settings.SECRET_KEY.encode('utf-8')).digest())
+    return Fernet(key)
+
+
+def enqueue_create_user(user, password, active=False):
+
+    secret = get_fernet().encrypt(password.encode('utf-8')).decode('ascii')
+
+    return IdpOutbox.objects.create(
+        user=user,
+        operation=constants.CREATE_USER,
+        secret=secret,
+        active=active
+    )
+
+
+def enqueue_activate_user(user):
+
+    return IdpOutbox.objects.create(user=user, operation=constants.ACTIVATE_USER)
+
+
+def claim(entries):
+
+    # Moving next_attempt forward works as a lease: only the worker whose
+    # conditional update succeeded processes the entry, and it becomes due
+    # again if that worker dies before finishing. The attempt is counted
+    # here, so a creation whose worker died after posting it is known to
+    # have been attempted.
+
+    lease = timezone.now() + datetime.timedelta(seconds=settings.IDP_OUTBOX_LEASE)
+    claimed = []
+
+    for entry in entries:
+
+        updated = IdpOutbox.objects.filter(
+            pk=entry.pk,
+            status=constants.OUTBOX_PENDING,
+            next_attempt=entry.next_attempt
+        ).update(next_attempt=lease, attempts=F('attempts') + 1)
+
+        if updated:
+            entry.next_attempt = lease
+            entry.attempts += 1
+            claimed.append(entry)
+
+    return claimed
+
+
+def process_outbox(batch_size):
+
+    entries = claim(IdpOutbox.objects.filter(
+        status=constants.OUTBOX_PENDING,
+        next_attempt__lte=timezone.now()
+    ).select_related('user').order_by('id')[:batch_size])
+
+    # Creations go first, activations of users created in the same batch can
+    # then be delivered straight away
+    deliver_creations([e for e in entries if e.operation == constants.CREATE_USER])
+
+    for entry in entries:
+        if entry.operation == constants.ACTIVATE_USER:
+            deliver_activation(entry)
+
+    return len(entries)
+
+
+def deliver_creations(entries):
+
+    users = {}
+    decrypted = []
+
+    for entry in adopt_created(entries):
+
+        try:
+            password = decrypt_secret(entry)
+
+        except Exception as e:
+            mark_failed(entry, e)
+            continue
+
+        # Users activated locally while their creation was pending are
+        # created active right away
+        users[entry.pk] = (entry.user, password, entry.active or entry.user.is_active)
+        decrypted.append(entry)
+
+    entries = decrypted
+
+    if settings.SCIM_BULK_ENABLED and len(entries) > 1:
+
+        try:
+            results = idp.bulk_create_users(users)
+
+        except Exception as e:
+            for entry in entries:
+                mark_failed(entry, e)
+            return
+
+        for entry in entries:
+
+            if results[entry.pk]:
+                mark_created(entry, results[entry.pk], users[entry.pk][2])
+            else:
+                mark_failed(entry, 'Bulk operation failed')
+
+        return
+
+    for entry in entries:
+
+        user, password, active = users[entry.pk]
+
+        try:
+            mark_created(entry, idp.create_user(user, password, active), active)
+
+        except Exception as e:
+            mark_failed(entry, e)
+
+
+def adopt_created(entries):
+
+    # A creation that timed out may still have reached the idp. Retries take
+    # over the user it created instead of posting a second one with the same
+    # email. Returns the entries that still have to be created.
+
+    pending = []
+
+    for entry in entries:
+
+        # The first attempt is the one counted by this claim
+        if entry.attempts == 1:
+            pending.append(entry)
+            continue
+
+        try:
+            resource = idp.find_user(entry.user.email)
+
+        except Exception as e:
+            mark_failed(entry, e)
+            continue
+
+        if resource is None:
+            pending.append(entry)
+
+        else:
+            # Activations left pending are delivered if the idp user is not
+            # active yet
+            mark_created(entry, resource['id'], bool(resource.get('active')))
+
+    return pending
+
+
+def deliver_activation(entry):
+
+    user = entry.user
+    user.refresh_from_db(fields=['idp_uuid'])
+
+    if not user.idp_uuid:
+
+        if IdpOutbox.objects.filter(
+                user=user, operation=constants.CREATE_USER, status=constants.OUTBOX_PENDING).exists():
+
+            # Waits for the creation without using up an attempt
+            entry.attempts -= 1
+            entry.next_attempt = timezone.now() + datetime.timedelta(seconds=settings.IDP_OUTBOX_RETRY_DELAY)
+            entry.save(update_fields=['attempts', 'next_attempt'])
+
+        else:
+            mark_failed(entry, 'User {} has no idp uuid'.format(user.email))
+
+        return
+
+    try:
+        idp.activate_user(user)
+        mark_done(entry)
+
+    except Exception as e:
+        mark_failed(entry, e)
+
+
+def decrypt_secret(entry):
+
+    return get_fernet().decrypt(entry.secret.encode('ascii')).decode('utf-8')
+
+
+def mark_created(entry, idp_uuid, active):
+
+    with transaction.atomic():
+
+        user = entry.user
+        user.idp_uuid = idp_uuid
+        user.save(update_fields=['idp_uuid'])
+
+        mark_done(entry)
+
+        if active:
+            IdpOutbox.objects.filter(
+                user=user,
+                operation=constants.ACTIVATE_USER,
+                status=constants.OUTBOX_PENDING
+            ).update(status=constants.OUTBOX_DONE, processed=timezone.now())
+
+
+def mark_done(entry):
+
+    entry.status = constants.OUTBOX_DONE
+    entry.secret = ''
+    entry.processed = timezone.now()
+    entry.save()
+
+    logger.info('Delivered {} for {}'.format(entry.operation, entry.user.email))
+
+
+def mark_failed(entry, error):
+
+    # The attempt was counted when the entry was claimed
+    entry.last_error = str(error)
+
+    if entry.attempts >= settings.IDP_OUTBOX_MAX_ATTEMPTS:
+
+        entry.status = constants.OUTBOX_FAILED
+        entry.secret = ''
+        logger.error('Giving up on {} for {}: {}'.format(entry.operation, entry.user.email, error))
+
+    else:
+
+        delay = settings.IDP_OUTBOX_RETRY_DELAY * 2 ** (entry.attempts - 1)
+        entry.next_attempt = timezone.now() + datetime.timedelta(seconds=delay)
+        logger.error('Failed {} for {}, retrying in {}s: {}'.format(
+            entry.operation, entry.user.email, delay, error))
+
+    entry.save()
@@ -0,0 +1,27 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from account.counters import recount_credit, recount_installations, recount_payments
+from account.models import Credit
+from gluu_license.models import License, LicenseRecord
+from payment.models import Payment
+
+
+@receiver([post_save, post_delete], sender=LicenseRecord)
+def license_record_changed(sender, instance, **kwargs):
+
+    account_id = License.objects.filter(pk=instance.license_id).values_list(
+        'account_id', flat=True).first()
+
+    if account_id:
+        recount_installations(account_id)
+
+
+@receiver([post_save, post_delete], sender=Payment)
+def payment_changed(sender, instance, **kwargs):
+    recount_payments(instance.account_id)
+
+
+@receiver([post_save, post_delete], sender=Credit)
+def credit_changed(sender, instance, **kwargs):
+    recount_credit(instance.account_id)
@@ -1,3 +1,140 @@
-from django.test import TestCase
+import datetime
 
-# Create your tests here.
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from account import constants, outbox
+from account.connectors import idp_interface
+from account.models import EcommerceUser, IdpOutbox
+
+
+def fail(*args, **kwargs):
+    raise AssertionError('Unexpected idp call')
+
+
+@override_settings(SCIM_BULK_ENABLED=False)
+class OutboxTest(TestCase):
+
+    def setUp(self):
+
+        self.user = EcommerceUser.objects.create_user(
+            'user@example.com', 'secret', first_name='Jane', last_name='Doe', phone_number='1')
+
+        self.patch(idp_interface, 'create_user', fail)
+        self.patch(idp_interface, 'find_user', fail)
+
+    def patch(self, target, name, value):
+
+        self.addCleanup(setattr, target, name, getattr(target, name))
+        setattr(target, name, value)
+
+    def test_claim_leases_entry_and_counts_attempt(self):
+
+        entry = outbox.enqueue_create_user(self.user, 'secret')
+        stale = IdpOutbox.objects.get(pk=entry.pk)
+
+        claimed = outbox.claim([entry])
+
+        self.assertEqual(claimed, [entry])
+
+        entry.refresh_from_db()
+        self.assertEqual(entry.attempts, 1)
+        self.assertGreater(entry.next_attempt, timezone.now())
+
+        # Another worker holding the entry as it was before the claim
+        self.assertEqual(outbox.claim([stale]), [])
+
+    def test_first_attempt_creates_user(self):
+
+        created = []
+
+        def create_user(user, password, active=False):
+            created.append((user.email, password, active))
+            return 'new-uuid'
+
+        self.patch(idp_interface, 'create_user', create_user)
+
+        entry = outbox.enqueue_create_user(self.user, 'secret')
+
+        self.assertEqual(outbox.process_outbox(10), 1)
+
+        entry.refresh_from_db()
+        self.user.refresh_from_db()
+
+        self.assertEqual(created, [('user@example.com', 'secret', True)])
+        self.assertEqual(entry.status, constants.OUTBOX_DONE)
+        self.assertEqual(entry.secret, '')
+        self.assertEqual(self.user.idp_uuid, 'new-uuid')
+
+    def test_expired_lease_adopts_user_created_by_dead_worker(self):
+
+        entry = outbox.enqueue_create_user(self.user, 'secret')
+
+        # Claimed by a worker that died after posting the user
+        IdpOutbox.objects.filter(pk=entry.pk).update(
+            attempts=1, next_attempt=timezone.now() - datetime.timedelta(seconds=1))
+
+        self.patch(idp_interface, 'find_user', lambda email: {'id': 'existing-uuid', 'active': True})
+
+        outbox.process_outbox(10)
+
+        entry.refresh_from_db()
+        self.user.refresh_from_db()
+
+        self.assertEqual(entry.status, constants.OUTBOX_DONE)
+        self.assertEqual(self.user.idp_uuid, 'existing-uuid')
+
+    def test_failed_creation_is_retried_later(self):
+
+        def create_user(user, password, active=False):
+            raise Exception('Timed out')
+
+        self.patch(idp_interface, 'create_user', create_user)
+
+        entry = outbox.enqueue_create_user(self.user, 'secret')
+
+        outbox.process_outbox(10)
+
+        entry.refresh_from_db()
+
+        self.assertEqual(entry.status, constants.OUTBOX_PENDING)
+        self.assertEqual(entry.attempts, 1)
+        self.assertEqual(entry.last_error, 'Timed out')
+        self.assertGreater(entry.next_attempt, timezone.now())
+
+    @override_settings(IDP_OUTBOX_MAX_ATTEMPTS=1)
+    def test_undecryptable_secret_fails_only_its_entry(self):
+
+        broken = outbox.enqueue_create_user(self.user, 'secret')
+        IdpOutbox.objects.filter(pk=broken.pk).update(secret='not a token')
+
+        other_user = EcommerceUser.objects.create_user(
+            'other@example.com', 'secret', first_name='John', last_name='Doe', phone_number='2')
+        other = outbox.enqueue_create_user(other_user, 'secret')
+
+        self.patch(idp_interface, 'create_user', lambda user, password, active=False: 'other-uuid')
+
+        outbox.process_outbox(10)
+
+        broken.refresh_from_db()
+        other.refresh_from_db()
+
+        self.assertEqual(broken.status, constants.OUTBOX_FAILED)
+        self.assertEqual(broken.secret, '')
+        self.assertEqual(other.status, constants.OUTBOX_DONE)
+
+    def test_activation_waits_for_pending_creation(self):
+
+        creation = outbox.enqueue_create_user(self.user, 'secret')
+        IdpOutbox.objects.filter(pk=creation.pk).update(
+            next_attempt=timezone.now() + datetime.timedelta(hours=1))
+
+        activation = outbox.enqueue_activate_user(self.user)
+
+        outbox.process_outbox(10)
+
+        activation.refresh_from_db()
+
+        self.assertEqual(activation.status, constants.OUTBOX_PENDING)
+        self.assertEqual(activation.attempts, 0)
+        self.assertGreater(activation.next_attempt, timezone.now())
@@ -44,9 +44,10 @@ def generate_activation_key(email):
     return activation_key
 
 
-def send_invitation(invitation):
+def send_invitation(invitation, existing=None):
 
-    existing = email_exists(invitation.email)
+    if existing is None:
+        existing = email_exists(invitation.email)
 
     if existing:
 
@@ -81,9 +82,10 @@ def send_invitation(invitation):
     )
 
 
-def send_premium_invitation(invitation):
+def send_premium_invitation(invitation, existing=None):
 
-    existing = email_exists(invitation.email)
+    if existing is None:
+        existing = email_exists(invitation.email)
 
     if existing:
 
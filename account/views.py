@@ -1,7 +1,6 @@
 import json
 import logging
 import datetime
-import stripe
 
 from django.conf import settings
 from django.contrib import messages
@@ -9,6 +8,7 @@ from django.contrib.auth import logout
 from django.contrib.auth.decorators import login_required
 from django.core.exceptions import ObjectDoesNotExist
 from django.core.urlresolvers import reverse
+from django.db import transaction
 from django.http import HttpResponseRedirect, HttpResponseServerError
 from django.shortcuts import render
 from django.utils import timezone
@@ -19,19 +19,20 @@ from social.apps.django_app.default.models import UserSocialAuth
 from account.constants import GENERIC_ERROR_DESCRIPTION_REGISTRATION as GENERIC_ERROR_DESC
 from account import constants
 from account import forms
-from account.connectors import idp_interface as idp
 from account.models import Activation, EcommerceUser, Invitation, Credit, PremiumInvitation
 from account.utils import (send_activation_email, create_invite, generate_activation_key,
                            send_new_account_notification)
+from account.outbox import enqueue_create_user, enqueue_activate_user
 
 from payment.models import Payment
 
 from gluu_license.connectors.license_interface import (
-    acquire_license, get_usage_records, retrieve_active_installations)
-from gluu_license.models import License
+    get_usage_records, license_records, retrieve_active_installations)
+from gluu_license.pool import provision_license
+
+from gluu_ecommerce.utils import fan_out
 
 logger = logging.getLogger('django')
-stripe.api_key = settings.STRIPE_API_KEY
 
 
 def register(request):
@@ -53,29 +54,26 @@ def register(request):
 
             if user_form.is_valid() and account_form.is_valid():
 
-                user = user_form.save(commit=False)
-                user.is_active = False
-                user.save()
+                with transaction.atomic():
 
-                user.idp_uuid = idp.create_user(
-                    user=user,
-                    password=user_form.cleaned_data.get('password1')
-                )
+                    user = user_form.save(commit=False)
+                    user.is_active = False
+                    user.save()
 
-                user.save()
+                    enqueue_create_user(user, user_form.cleaned_data.get('password1'))
 
-                activation_key = generate_activation_key(user.email)
-                activation = Activation(user=user, activation_key=activation_key)
-                activation.save()
+                    activation_key = generate_activation_key(user.email)
+                    activation = Activation(user=user, activation_key=activation_key)
+                    activation.save()
 
-                send_activation_email(user, activation_key)
+                    account = account_form.save(commit=False)
+                    account.primary_contact = user
+                    account.save()
 
-                account = account_form.save(commit=False)
-                account.primary_contact = user
-                account.save()
+                    user.account = account
+                    user.save()
 
-                user.account = account
-                user.save()
+                send_activation_email(user, activation_key)
 
                 send_new_account_notification(account)
 
@@ -154,19 +152,17 @@ def register_invited(request, activation_key):
 
             if registration_form.is_valid():
 
-                user = registration_form.save(commit=False)
-                user.account = invitation.invited_by.account
-                user.save()
+                with transaction.atomic():
 
-                user.idp_uuid = idp.create_user(
-                    user=user,
-                    password=registration_form.cleaned_data.get('password1'),
-                    active=True
-                )
-                user.save()
+                    user = registration_form.save(commit=False)
+                    user.account = invitation.invited_by.account
+                    user.save()
 
-                invitation.activation_key = 'ACTIVATED'
-                invitation.save()
+                    enqueue_create_user(
+                        user, registration_form.cleaned_data.get('password1'), active=True)
+
+                    invitation.activation_key = 'ACTIVATED'
+                    invitation.save()
 
                 return render(request, 'account/activation_complete.html')
 
@@ -208,27 +204,23 @@ def register_premium(request, activation_key):
 
             if user_form.is_valid() and account_form.is_valid():
 
-                user = user_form.save(commit=False)
-                user.save()
+                with transaction.atomic():
 
-                user.idp_uuid = idp.create_user(
-                    user=user,
-                    password=user_form.cleaned_data.get('password1'),
-                    active=True
-                )
+                    user = user_form.save(commit=False)
+                    user.save()
 
-                user.save()
+                    enqueue_create_user(user, user_form.cleaned_data.get('password1'), active=True)
 
-                account = account_form.save(commit=False)
-                account.primary_contact = user
-                account.payment_on_platform = False
-                account.save()
+                    account = account_form.save(commit=False)
+                    account.primary_contact = user
+                    account.payment_on_platform = False
+                    account.save()
 
-                user.account = account
-                user.save()
+                    user.account = account
+                    user.save()
 
-                invitation.activation_key = 'ACTIVATED'
-                invitation.save()
+                    invitation.activation_key = 'ACTIVATED'
+                    invitation.save()
 
                 send_new_account_notification(account)
 
@@ -306,15 +298,17 @@ def activate(request, activation_key):
 
     try:
 
-        activation = Activation.objects.get(activation_key=activation_key)
-        activation.activation_key = 'ACTIVATED'
-        activation.save()
+        with transaction.atomic():
 
-        user = activation.user
-        user.is_active = True
-        user.save()
+            activation = Activation.objects.get(activation_key=activation_key)
+            activation.activation_key = 'ACTIVATED'
+            activation.save()
+
+            user = activation.user
+            user.is_active = True
+            user.save()
 
-        idp.activate_user(user)
+            enqueue_activate_user(user)
 
         return render(request, 'account/activation_complete.html')
 
@@ -390,25 +384,28 @@ def dashboard(request):
             )
             credit.save()
 
-        license = acquire_license(account.get_name())
-        license = License(
-            license_id=license['license_id'],
-            license_password=license['license_password'],
-            public_password=license['public_password'],
-            public_key=license['public_key'],
-            account=account,
-            expiration_date=license['expiration_date'],
-            creation_date=license['creation_date']
-        )
-        license.save()
+        if provision_license(account) is None:
+            logger.error('Failed to provision a license for account {}'.format(account))
+            return HttpResponseServerError()
 
     billing_admins = request.user.account.billing_admins.all()
     invitation_form = forms.InvitationForm()
     invites = Invitation.objects.filter(invited_by=request.user).exclude(
         activation_key__in=['REVOKED', 'ACTIVATED', 'EXPIRED'])
 
-    license_records = get_usage_records(request.user.account.license)
-    active_mac_addresses = retrieve_active_installations(request.user.account.license.license_id)
+    license = request.user.account.license
+
+    results, failed = fan_out({
+        'license_records': (get_usage_records, (license,)),
+        'active_mac_addresses': (retrieve_active_installations, (license.license_id,))
+    }, settings.DASHBOARD_UPSTREAM_TIMEOUT)
+
+    records = results.get('license_records')
+
+    if records is None:
+        records = license_records(license)
+
+    active_mac_addresses = results.get('active_mac_addresses')
 
     last_payment = None
 
@@ -425,9 +422,10 @@ def dashboard(request):
         {'invitation_form': invitation_form,
          'billing_admins': billing_admins,
          'invites': invites,
-         'license_records': license_records,
+         'license_records': records,
          'last_payment': last_payment,
-         'active_mac_addresses': active_mac_addresses}
+         'active_mac_addresses': active_mac_addresses,
+         'upstream_unavailable': failed}
     )
 
 
@@ -0,0 +1,237 @@
+import errno
+import fcntl
+import hashlib
+import os
+import threading
+import time
+import uuid
+
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from django.core.cache.backends.filebased import FileBasedCache
+
+
+class TTLCache(object):
+
+    # Thread safe, in-process cache. Every entry carries its own expiry and
+    # the least recently used entries are evicted once max_entries is reached.
+
+    def __init__(self, max_entries=1000):
+
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+
+        with self._lock:
+
+            try:
+                value, expires_at = self._entries.pop(key)
+
+            except KeyError:
+                self.misses += 1
+                return default
+
+            if expires_at <= time.time():
+                self.misses += 1
+                return default
+
+            self._entries[key] = (value, expires_at)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, timeout):
+
+        with self._lock:
+
+            self._entries.pop(key, None)
+
+            while len(self._entries) >= self.max_entries:
+                self._entries.popitem(last=False)
+
+            self._entries[key] = (value, time.time() + timeout)
+
+    def delete(self, key):
+
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'size': len(self._entries)}
+
+
+class SingleFlight(object):
+
+    # Coalesces concurrent calls sharing a key: the first caller runs the
+    # function and every caller arriving while it is in flight waits for, and
+    # shares, its result or exception.
+
+    def __init__(self):
+
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, func, *args, **kwargs):
+
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            call.done.wait()
+
+            if call.error:
+                raise call.error
+
+            return call.result
+
+        try:
+            call.result = func(*args, **kwargs)
+            return call.result
+
+        except Exception as e:
+            call.error = e
+            raise
+
+        finally:
+            with self._lock:
+                del self._calls[key]
+
+            call.done.set()
+
+
+class _Call(object):
+
+    def __init__(self):
+
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+@contextmanager
+def cache_lock(cache, key, timeout=30, wait=None, interval=0.1):
+
+    # Lock shared by every process using the same django cache. add() only
+    # stores the key when it is missing, and the timeout releases locks left
+    # behind by crashed workers. Yields whether the lock was acquired within
+    # `wait` seconds (defaults to `timeout`).
+
+    deadline = time.time() + (timeout if wait is None else wait)
+
+    # The file cache's add() checks for the key and writes it in two steps,
+    # a lock file next to its entries is used instead
+    if isinstance(cache, FileBasedCache):
+
+        name = '{}.lock'.format(hashlib.sha1(key.encode('utf-8')).hexdigest())
+
+        with file_lock(os.path.join(cache._dir, name), deadline, interval) as acquired:
+            yield acquired
+
+        return
+
+    token = uuid.uuid4().hex
+
+    acquired = cache.add(key, token, timeout)
+
+    while not acquired and time.time() < deadline:
+        time.sleep(interval)
+        acquired = cache.add(key, token, timeout)
+
+    try:
+        yield acquired
+
+    finally:
+        if acquired and cache.get(key) == token:
+            cache.delete(key)
+
+
+@contextmanager
+def file_lock(path, deadline, interval=0.1):
+
+    # flock() on a file of the shared cache directory. The kernel releases
+    # the lock when its holder exits, so crashed workers need no timeout.
+
+    try:
+        os.makedirs(os.path.dirname(path))
+
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+
+    fd = os.open(path, os.O_CREAT | os.O_RDWR, 0o600)
+
+    try:
+
+        acquired = try_flock(fd)
+
+        while not acquired and time.time() < deadline:
+            time.sleep(interval)
+            acquired = try_flock(fd)
+
+        try:
+            yield acquired
+
+        finally:
+            if acquired:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+
+    finally:
+        os.close(fd)
+
+
+def try_flock(fd):
+
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        return True
+
+    except IOError as e:
+
+        if e.errno in (errno.EAGAIN, errno.EACCES):
+            return False
+
+        raise
+
+
+class CacheStats(object):
+
+    # Hit and miss counters for caches that are not a TTLCache, e.g. those
+    # kept in a django cache backend
+
+    def __init__(self):
+
+        self.hits = 0
+        self.misses = 0
+
+        self._lock = threading.Lock()
+
+    def hit(self):
+
+        with self._lock:
+            self.hits += 1
+
+    def miss(self):
+
+        with self._lock:
+            self.misses += 1
+
+    def as_dict(self):
+
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses}
@@ -0,0 +1,111 @@
+import threading
+import time
+
+from contextlib import contextmanager
+
+import requests
+
+from requests.adapters import HTTPAdapter
+
+from django.conf import settings
+from django.utils.six.moves import http_cookiejar
+from django.utils.six.moves.urllib.parse import urlparse
+
+# One pooled session per upstream host. Keeping connections alive saves the
+# TCP and TLS handshakes on every call to idp.gluu.org and license.gluu.org.
+
+_sessions = {}
+_lock = threading.Lock()
+_local = threading.local()
+
+
+def create_session():
+
+    session = requests.Session()
+
+    adapter = HTTPAdapter(
+        pool_connections=1,
+        pool_maxsize=settings.CONNECTOR_POOL_MAXSIZE,
+        max_retries=0
+    )
+
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+
+    # Sessions are shared by every request served by this process, so they
+    # must not carry cookies from one call over to the next
+    session.cookies.set_policy(http_cookiejar.DefaultCookiePolicy(allowed_domains=[]))
+
+    return session
+
+
+def get_session(url):
+
+    host = urlparse(url).netloc
+
+    session = _sessions.get(host)
+
+    if session is None:
+
+        with _lock:
+
+            session = _sessions.get(host)
+
+            if session is None:
+                session = _sessions[host] = create_session()
+
+    return session
+
+
+@contextmanager
+def deadline(moment):
+
+    # Caps the timeouts of the requests this thread makes, so none of them
+    # waits past `moment` (a time.time() value)
+
+    previous = getattr(_local, 'deadline', None)
+    _local.deadline = moment
+
+    try:
+        yield
+
+    finally:
+        _local.deadline = previous
+
+
+def get_timeout(url):
+
+    # (connect, read) timeouts in seconds
+
+    timeout = settings.CONNECTOR_TIMEOUTS.get(urlparse(url).netloc, settings.CONNECTOR_DEFAULT_TIMEOUT)
+    moment = getattr(_local, 'deadline', None)
+
+    if moment is None:
+        return timeout
+
+    remaining = moment - time.time()
+
+    if remaining <= 0:
+        raise requests.Timeout('Deadline passed before requesting {}'.format(url))
+
+    return tuple(min(seconds, remaining) for seconds in timeout)
+
+
+def request(method, url, **kwargs):
+
+    if 'timeout' not in kwargs:
+        kwargs['timeout'] = get_timeout(url)
+
+    return get_session(url).request(method, url, **kwargs)
+
+
+def get(url, **kwargs):
+    return request('GET', url, **kwargs)
+
+
+def post(url, **kwargs):
+    return request('POST', url, **kwargs)
+
+
+def put(url, **kwargs):
+    return request('PUT', url, **kwargs)
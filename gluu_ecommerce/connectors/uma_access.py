@@ -1,10 +1,26 @@
 import logging
-import requests
+import time
+
+from hashlib import sha1
 
 from django.conf import settings
+from django.core.cache import caches
+
+from gluu_ecommerce.cache import SingleFlight, TTLCache, cache_lock
+from gluu_ecommerce.connectors import http_client
 
 logger = logging.getLogger('idp')
 
+AAT_CACHE_KEY = 'aat'
+RPT_CACHE_KEY = 'rpt'
+AUTHORIZED_RPT_CACHE_KEY = 'rpt:{}'
+
+_tokens = TTLCache(max_entries=settings.UMA_TOKEN_CACHE_SIZE)
+
+# Concurrent threads needing the same token wait on a single acquisition
+# instead of each running the handshake against the idp
+_flights = SingleFlight()
+
 
 def obtain_aat():
 
@@ -18,7 +34,7 @@ def obtain_aat():
 
     }
 
-    response = requests.post(
+    response = http_client.post(
         'https://idp.gluu.org/oxauth/seam/resource/restv1/oxauth/token',
         data=payload,
         verify=settings.VERIFY_SSL
@@ -26,7 +42,8 @@ def obtain_aat():
 
     if response.status_code == 200 and response.json()['scope'] == 'uma_authorization':
 
-        return response.json()['access_token']
+        token = response.json()
+        return token['access_token'], int(token.get('expires_in', 0))
 
     else:
 
@@ -44,7 +61,7 @@ def obtain_rpt(access_token):
 
     headers = {'Authorization': 'Bearer {}'.format(access_token)}
 
-    response = requests.post(
+    response = http_client.post(
         'https://idp.gluu.org/oxauth/seam/resource/restv1/requester/rpt',
         data={},
         headers=headers,
@@ -69,7 +86,7 @@ def obtain_resource_ticket(rpt, resource_uri):
 
     headers = {'Authorization': 'Bearer {}'.format(rpt)}
 
-    response = requests.get(
+    response = http_client.get(
         resource_uri,
         headers=headers,
         verify=settings.VERIFY_SSL
@@ -96,7 +113,7 @@ def authorize_rpt(access_token, rpt, ticket):
 
     payload = {'ticket': ticket, 'rpt': rpt}
 
-    response = requests.post(
+    response = http_client.post(
         'https://idp.gluu.org/oxauth/seam/resource/restv1/requester/perm',
         json=payload,
         headers=headers,
@@ -115,13 +132,115 @@ def authorize_rpt(access_token, rpt, ticket):
     return rpt
 
 
-def obtain_authorized_rpt_token(resource_uri=None, ticket=None):
+def token_lifetime(expires_in):
+
+    # Tokens are dropped shortly before they expire upstream so that a cached
+    # token is never sent to the resource server after it has become invalid
+
+    return max(expires_in - settings.UMA_TOKEN_EXPIRY_MARGIN, 0)
+
+
+def token_store():
+    return caches[settings.UMA_TOKEN_CACHE]
+
+
+def shared_key(key):
+    return 'uma:{}'.format(sha1(key.encode('utf-8')).hexdigest())
+
+
+def get_token(key, acquire, *args):
+
+    # Tokens are looked up in this process first and then in the store shared
+    # by all workers. Entries are (token, expires_at) tuples.
+
+    entry = _tokens.get(key)
+
+    if not entry:
+        entry = _flights.do(key, load_token, key, acquire, *args)
+
+    return entry
+
+
+def load_token(key, acquire, *args):
+
+    store = token_store()
+
+    # Re-checked as another flight may have just finished refreshing it
+    entry = _tokens.get(key) or store.get(shared_key(key))
+
+    if not entry:
+
+        # Only one worker runs the handshake, the others pick up its result.
+        # If the lock can't be obtained in time the token is acquired anyway.
+        with cache_lock(store, shared_key(key) + ':lock', timeout=settings.UMA_TOKEN_LOCK_TIMEOUT):
+
+            entry = store.get(shared_key(key))
+
+            if not entry:
+                entry = acquire(*args)
+                store.set(shared_key(key), entry, entry[1] - time.time())
+
+    _tokens.set(key, entry, entry[1] - time.time())
+
+    return entry
 
-    access_token = obtain_aat()
+
+def acquire_aat():
+
+    access_token, expires_in = obtain_aat()
+
+    return access_token, time.time() + token_lifetime(expires_in)
+
+
+def acquire_rpt():
+
+    access_token, _ = get_token(AAT_CACHE_KEY, acquire_aat)
 
     rpt = obtain_rpt(access_token)
 
+    return rpt, time.time() + token_lifetime(settings.UMA_RPT_LIFETIME)
+
+
+def acquire_resource_authorization(resource_uri):
+
+    access_token, _ = get_token(AAT_CACHE_KEY, acquire_aat)
+
+    rpt, expires_at = get_token(RPT_CACHE_KEY, acquire_rpt)
+
+    ticket = obtain_resource_ticket(rpt, resource_uri)
+
+    return authorize_rpt(access_token, rpt, ticket), expires_at
+
+
+def invalidate_rpt_token(resource_uri=None):
+
+    keys = [AAT_CACHE_KEY, RPT_CACHE_KEY]
+
+    if resource_uri:
+        keys.append(AUTHORIZED_RPT_CACHE_KEY.format(resource_uri))
+
+    _tokens.clear()
+    token_store().delete_many([shared_key(key) for key in keys])
+
+
+def obtain_authorized_rpt_token(resource_uri=None, ticket=None, force_refresh=False):
+
+    # An RPT authorized for a resource stays authorized for its whole lifetime,
+    # so it is reused per resource uri. Ticket based authorizations are one-off,
+    # but they still reuse the cached AAT and RPT.
+
+    if force_refresh:
+        invalidate_rpt_token(resource_uri)
+
     if not ticket:
-        ticket = obtain_resource_ticket(rpt, resource_uri)
+
+        rpt, _ = get_token(
+            AUTHORIZED_RPT_CACHE_KEY.format(resource_uri), acquire_resource_authorization, resource_uri)
+
+        return rpt
+
+    access_token, _ = get_token(AAT_CACHE_KEY, acquire_aat)
+
+    rpt, _ = get_token(RPT_CACHE_KEY, acquire_rpt)
 
     return authorize_rpt(access_token, rpt, ticket)
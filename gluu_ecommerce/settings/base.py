@@ -92,6 +92,27 @@ DATABASES = {
     'default': dj_database_url.config()
 }
 
+# Caches
+# https://docs.djangoproject.com/en/1.10/topics/cache/
+
+# The connectors cache is shared by every worker on every node, so it has to
+# be a database cache (`manage.py createcachetable`), memcached or a file cache
+# on shared storage that supports flock()
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'connectors': {
+        'BACKEND': os.environ.get(
+            'CONNECTOR_CACHE_BACKEND', 'django.core.cache.backends.db.DatabaseCache'),
+        'LOCATION': os.environ.get('CONNECTOR_CACHE_LOCATION', 'connector_cache'),
+        'OPTIONS': {
+            'MAX_ENTRIES': int(os.environ.get('CONNECTOR_CACHE_MAX_ENTRIES', '10000'))
+        }
+    }
+}
+
 # Authentication
 
 AUTH_USER_MODEL = 'account.EcommerceUser'
@@ -239,6 +260,24 @@ else:
 
 DOMAIN = os.environ.get('DOMAIN')
 
+# Upstream connectors, timeouts are (connect, read) in seconds
+CONNECTOR_POOL_MAXSIZE = int(os.environ.get('CONNECTOR_POOL_MAXSIZE', '10'))
+CONNECTOR_DEFAULT_TIMEOUT = (3.05, 30)
+CONNECTOR_TIMEOUTS = {
+    'idp.gluu.org': (
+        float(os.environ.get('IDP_CONNECT_TIMEOUT', '3.05')),
+        float(os.environ.get('IDP_READ_TIMEOUT', '15'))
+    ),
+    'license.gluu.org': (
+        float(os.environ.get('LICENSE_CONNECT_TIMEOUT', '3.05')),
+        float(os.environ.get('LICENSE_READ_TIMEOUT', '30'))
+    ),
+    'api.stripe.com': (
+        float(os.environ.get('STRIPE_CONNECT_TIMEOUT', '3.05')),
+        float(os.environ.get('STRIPE_READ_TIMEOUT', '60'))
+    ),
+}
+
 # Emails
 LIVE_EMAIL = bool(int(os.environ.get('LIVE_EMAIL', '1')))
 
@@ -275,12 +314,72 @@ else:
     UMA_CLIENT_ID = os.environ.get('UMA_CLIENT_ID')
     UMA_CLIENT_SECRET = os.environ.get('UMA_CLIENT_SECRET')
 
+SCIM_CACHE = 'connectors'
+SCIM_EMAIL_EXISTS_TTL = int(os.environ.get('SCIM_EMAIL_EXISTS_TTL', '3600'))
+SCIM_EMAIL_MISSING_TTL = int(os.environ.get('SCIM_EMAIL_MISSING_TTL', '60'))
+SCIM_FILTER_CHUNK_SIZE = int(os.environ.get('SCIM_FILTER_CHUNK_SIZE', '20'))
+SCIM_PAGE_SIZE = int(os.environ.get('SCIM_PAGE_SIZE', '100'))
+SCIM_SYNC_OVERLAP = int(os.environ.get('SCIM_SYNC_OVERLAP', '300'))
+# Fall back to a live SCIM read for users that are not mirrored yet
+SCIM_MIRROR_LIVE_FALLBACK = bool(int(os.environ.get('SCIM_MIRROR_LIVE_FALLBACK', '0')))
+
+SCIM_BULK_ENABLED = bool(int(os.environ.get('SCIM_BULK_ENABLED', '1')))
+
+IDP_OUTBOX_BATCH_SIZE = int(os.environ.get('IDP_OUTBOX_BATCH_SIZE', '50'))
+IDP_OUTBOX_MAX_ATTEMPTS = int(os.environ.get('IDP_OUTBOX_MAX_ATTEMPTS', '8'))
+IDP_OUTBOX_RETRY_DELAY = int(os.environ.get('IDP_OUTBOX_RETRY_DELAY', '30'))
+IDP_OUTBOX_LEASE = int(os.environ.get('IDP_OUTBOX_LEASE', '300'))
+
+# Seconds; RPT creation responses don't carry an expiry, so this must not
+# exceed the rpt lifetime configured on the oxAuth server
+UMA_RPT_LIFETIME = int(os.environ.get('UMA_RPT_LIFETIME', '3600'))
+UMA_TOKEN_EXPIRY_MARGIN = int(os.environ.get('UMA_TOKEN_EXPIRY_MARGIN', '60'))
+UMA_TOKEN_CACHE_SIZE = int(os.environ.get('UMA_TOKEN_CACHE_SIZE', '1000'))
+UMA_TOKEN_CACHE = 'connectors'
+UMA_TOKEN_LOCK_TIMEOUT = int(os.environ.get('UMA_TOKEN_LOCK_TIMEOUT', '30'))
+
 # Stripe Payments
 STRIPE_API_KEY = os.environ.get('STRIPE_API_KEY')
 STRIPE_PUBLIC_KEY = os.environ.get('STRIPE_PUBLIC_KEY')
+STRIPE_WEBHOOK_SECRET = os.environ.get('STRIPE_WEBHOOK_SECRET')
+# Seconds a webhook signature stays valid, guards against replays
+STRIPE_WEBHOOK_TOLERANCE = int(os.environ.get('STRIPE_WEBHOOK_TOLERANCE', '300'))
+STRIPE_EVENT_BATCH_SIZE = int(os.environ.get('STRIPE_EVENT_BATCH_SIZE', '50'))
+STRIPE_EVENT_MAX_ATTEMPTS = int(os.environ.get('STRIPE_EVENT_MAX_ATTEMPTS', '5'))
+STRIPE_EVENT_RETRY_DELAY = int(os.environ.get('STRIPE_EVENT_RETRY_DELAY', '30'))
+STRIPE_EVENT_LEASE = int(os.environ.get('STRIPE_EVENT_LEASE', '300'))
+# Charging runs stay below Stripe's live mode limit of 100 requests per
+# second, transient failures are retried with jittered exponential backoff
+STRIPE_CHARGE_WORKERS = int(os.environ.get('STRIPE_CHARGE_WORKERS', '8'))
+STRIPE_RATE_LIMIT = float(os.environ.get('STRIPE_RATE_LIMIT', '50'))
+STRIPE_MAX_RETRIES = int(os.environ.get('STRIPE_MAX_RETRIES', '4'))
+STRIPE_RETRY_DELAY = float(os.environ.get('STRIPE_RETRY_DELAY', '0.5'))
+# Seconds a charging worker holds the payments it claimed
+STRIPE_CHARGE_LEASE = int(os.environ.get('STRIPE_CHARGE_LEASE', '600'))
 
 LOGIN_URL = '/login/gluu/'
 
 # Business Logic
 PRICE_PER_LICENSE = float(os.environ.get('PRICE_PER_LICENSE', 0.33))
 MOCK_LICENSE = bool(int(os.environ.get('MOCK_LICENSE', '1'))) & DEBUG
+
+# oxLicense
+LICENSE_CACHE = 'connectors'
+# Seconds for which synced usage records are served without a refresh
+USAGE_SYNC_FRESHNESS = int(os.environ.get('USAGE_SYNC_FRESHNESS', '900'))
+# Days installation snapshots are kept at each resolution. MAC lists are
+# dropped after SNAPSHOT_MAC_RETENTION, which must cover two months.
+SNAPSHOT_HOURLY_RETENTION = int(os.environ.get('SNAPSHOT_HOURLY_RETENTION', '7'))
+SNAPSHOT_MAC_RETENTION = int(os.environ.get('SNAPSHOT_MAC_RETENTION', '70'))
+SNAPSHOT_DAILY_RETENTION = int(os.environ.get('SNAPSHOT_DAILY_RETENTION', '400'))
+
+# Licenses acquired ahead of time for new accounts, refilled up to
+# LICENSE_POOL_SIZE once fewer than LICENSE_POOL_LOW_WATERMARK are left
+LICENSE_POOL_NAME = os.environ.get('LICENSE_POOL_NAME', 'Gluu oxd')
+LICENSE_POOL_SIZE = int(os.environ.get('LICENSE_POOL_SIZE', '20'))
+LICENSE_POOL_LOW_WATERMARK = int(os.environ.get('LICENSE_POOL_LOW_WATERMARK', '5'))
+
+# Upstream calls made concurrently while rendering a page
+FAN_OUT_POOL_SIZE = int(os.environ.get('FAN_OUT_POOL_SIZE', '10'))
+# Seconds the dashboard waits for oxLicense before rendering what it has
+DASHBOARD_UPSTREAM_TIMEOUT = float(os.environ.get('DASHBOARD_UPSTREAM_TIMEOUT', '8'))
@@ -1,21 +1,33 @@
 import logging
+import math
 import random
+import threading
+from collections import defaultdict, deque
 from hashlib import sha1
+from multiprocessing import TimeoutError
+from multiprocessing.pool import ThreadPool
 
 import datetime
+import time
 
 from smtplib import SMTPRecipientsRefused
 
 
 from django.conf import settings
 from django.core.mail import EmailMultiAlternatives
+from django.db import connection
 from django.template import loader
 from django.utils.encoding import smart_bytes
 from django.utils.six import text_type
 
+from gluu_ecommerce.connectors import http_client
+
 
 logger = logging.getLogger('django')
 
+_pool = None
+_pool_lock = threading.Lock()
+
 
 def get_last_month():
 
@@ -79,3 +91,157 @@ def send_mail(subject_template_name, email_template_name, to_email, context=None
         message = 'Failed to send email to {}, Subject: {}, Exception: {}'.format(
             to_email, subject_template_name, e)
         logger.exception(message)
+
+
+def get_pool():
+
+    global _pool
+
+    if _pool is None:
+
+        with _pool_lock:
+
+            if _pool is None:
+                _pool = ThreadPool(settings.FAN_OUT_POOL_SIZE)
+
+    return _pool
+
+
+def run_task(func, args):
+
+    # Worker threads get their own database connection, it is closed once
+    # the task is done so connections are not leaked by the pool
+
+    try:
+        return func(*args)
+
+    finally:
+        connection.close()
+
+
+def run_task_until(deadline, func, args):
+
+    with http_client.deadline(deadline):
+        return run_task(func, args)
+
+
+def fan_out(calls, timeout):
+
+    # Runs independent calls concurrently on a shared, bounded pool. `calls`
+    # maps a name to (func, args). Returns the results by name together with
+    # the names of the calls that failed or missed the overall deadline. The
+    # upstream requests of the calls time out by the deadline too, so calls
+    # that miss it don't hold on to the pool's threads.
+
+    pool = get_pool()
+    deadline = time.time() + timeout
+
+    pending = dict(
+        (name, pool.apply_async(run_task_until, (deadline, func, args)))
+        for name, (func, args) in calls.items()
+    )
+    results = {}
+    failed = []
+
+    for name, result in pending.items():
+
+        try:
+            results[name] = result.get(max(deadline - time.time(), 0))
+
+        except TimeoutError:
+            logger.error('{} did not finish within {}s'.format(name, timeout))
+            failed.append(name)
+
+        except Exception as e:
+            logger.exception('{} failed: {}'.format(name, e))
+            failed.append(name)
+
+    return results, failed
+
+
+def percentile(values, percent):
+
+    # Nearest-rank percentile of an unsorted list, None when it is empty
+
+    if not values:
+        return None
+
+    values = sorted(values)
+    rank = int(math.ceil(percent / 100.0 * len(values)))
+
+    return values[max(rank, 1) - 1]
+
+
+class LatencyStats(object):
+
+    # Thread safe record of the latest call durations per name
+
+    def __init__(self, size=1000):
+
+        self._latencies = defaultdict(lambda: deque(maxlen=size))
+        self._lock = threading.Lock()
+
+    def record(self, name, seconds):
+
+        with self._lock:
+            self._latencies[name].append(seconds)
+
+    def summary(self):
+
+        with self._lock:
+            latencies = dict((name, list(values)) for name, values in self._latencies.items())
+
+        return dict(
+            (name, {
+                'count': len(values),
+                'p50': percentile(values, 50),
+                'p90': percentile(values, 90),
+                'p99': percentile(values, 99)
+            })
+            for name, values in latencies.items()
+        )
+
+
+class TokenBucket(object):
+
+    # Thread safe rate limiter, `rate` tokens per second are added up to
+    # `capacity` and acquire() blocks until a token is available
+
+    def __init__(self, rate, capacity=None):
+
+        self.rate = float(rate)
+        self.capacity = float(capacity or rate)
+
+        self._tokens = self.capacity
+        self._updated = time.time()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+
+        while True:
+
+            with self._lock:
+
+                now = time.time()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+
+                wait = (1 - self._tokens) / self.rate
+
+            time.sleep(wait)
+
+
+def parse_shard(value):
+
+    # 'INDEX/COUNT' as given on the command line, e.g. 0/4
+
+    index, count = [int(part) for part in value.split('/')]
+
+    if count < 1 or not 0 <= index < count:
+        raise ValueError('Shard index must be between 0 and {}'.format(count - 1))
+
+    return index, count
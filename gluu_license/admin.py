@@ -1,4 +1,5 @@
 from django.contrib import admin
+from django.db.models import Count
 
 from gluu_license import models
 
@@ -6,9 +7,19 @@ from gluu_license import models
 class LicenseRecordAdmin(admin.ModelAdmin):
 
     model = models.LicenseRecord
-    list_display = ('year', 'month', 'license', 'number_licenses', 'details')
+    list_display = ('year', 'month', 'license', 'number_licenses', 'mac_count')
     readonly_fields = ('created',)
 
+    def get_queryset(self, request):
+
+        return super(LicenseRecordAdmin, self).get_queryset(request).defer('details').annotate(
+            mac_count=Count('installations'))
+
+    def mac_count(self, obj):
+        return obj.mac_count
+
+    mac_count.admin_order_field = 'mac_count'
+
 admin.site.register(models.LicenseRecord, LicenseRecordAdmin)
 
 
@@ -19,3 +30,36 @@ class LicenseAdmin(admin.ModelAdmin):
     readonly_fields = ('creation_date',)
 
 admin.site.register(models.License, LicenseAdmin)
+
+
+class InstallationUsageAdmin(admin.ModelAdmin):
+
+    model = models.InstallationUsage
+    list_display = ('mac', 'count', 'record')
+    search_fields = ('mac', 'record__license__license_id')
+    raw_id_fields = ('record',)
+
+admin.site.register(models.InstallationUsage, InstallationUsageAdmin)
+
+
+class InstallationSnapshotAdmin(admin.ModelAdmin):
+
+    model = models.InstallationSnapshot
+    list_display = ('license', 'resolution', 'start', 'active', 'peak', 'average')
+    list_filter = ('resolution',)
+    search_fields = ('license__license_id',)
+    raw_id_fields = ('license',)
+    date_hierarchy = 'start'
+
+    def get_queryset(self, request):
+        return super(InstallationSnapshotAdmin, self).get_queryset(request).defer('macs')
+
+admin.site.register(models.InstallationSnapshot, InstallationSnapshotAdmin)
+
+
+class PooledLicenseAdmin(admin.ModelAdmin):
+
+    model = models.PooledLicense
+    list_display = ('id', 'license_id', 'creation_date', 'expiration_date')
+
+admin.site.register(models.PooledLicense, PooledLicenseAdmin)
@@ -2,15 +2,22 @@ import json
 import requests
 import datetime
 import logging
+import threading
+import time
 
 from django.conf import settings
-from django.core.exceptions import ObjectDoesNotExist
+from django.core.cache import caches
+from django.db import IntegrityError, connection, transaction
+from django.db.models import Count, Prefetch
 from django.utils import timezone
 
+from account.counters import recount_installations
 from gluu_license.utils import get_time_frame
-from gluu_license.models import LicenseRecord
+from gluu_license.models import InstallationUsage, License, LicenseRecord
 from gluu_license.connectors import mock
 from gluu_license.constants import ACTIVE_HOURS
+from gluu_ecommerce.cache import CacheStats, cache_lock
+from gluu_ecommerce.connectors import http_client
 from gluu_ecommerce.connectors.uma_access import obtain_authorized_rpt_token
 
 logger = logging.getLogger('django')
@@ -22,6 +29,11 @@ LICENSE_METADATA_ENDPOINT = 'https://license.gluu.org/oxLicense/rest/metadata'
 LICENSE_STATISTICS_ENDPOINT = 'https://license.gluu.org/oxLicense/rest/statistic/monthly?licenseId={}'
 LICENSE_STATISTICS_HOURLY_ENDPOINT = 'https://license.gluu.org/oxLicense/rest/statistic/lastHours'
 
+USAGE_SYNC_LOCK_KEY = 'license:usage-sync:{}'
+ACTIVE_INSTALLATIONS_CACHE_KEY = 'license:active:{}:{}'
+
+active_installations_stats = CacheStats()
+
 
 def time_in_milliseconds(date_time):
     return int(date_time.strftime('%s')) * 1000
@@ -36,7 +48,7 @@ def acquire_license(license_name, number_licenses=1):
 
     headers = {'Content-Type': 'application/json'}
 
-    response = requests.post(url, headers=headers)
+    response = http_client.post(url, headers=headers)
 
     if response.status_code != 403:
 
@@ -64,7 +76,7 @@ def acquire_license(license_name, number_licenses=1):
         'license_count_limit': 9999
     }
 
-    response = requests.post(
+    response = http_client.post(
         url,
         data=json.dumps(payload),
         headers=headers
@@ -88,7 +100,7 @@ def update_license_status(license):
 
     headers = {'Content-Type': 'application/json'}
 
-    response = requests.put(
+    response = http_client.put(
         LICENSE_METADATA_ENDPOINT,
         headers=headers
     )
@@ -118,7 +130,7 @@ def update_license_status(license):
         'expiration_date': time_in_milliseconds(license.expiration_date)
     }
 
-    response = requests.put(
+    response = http_client.put(
         LICENSE_METADATA_ENDPOINT,
         data=json.dumps(payload),
         headers=headers
@@ -136,7 +148,12 @@ def retrieve_usage_records(license_id):
     if settings.MOCK_LICENSE:
         return mock.mock_license_records()
 
-    response = requests.get(LICENSE_STATISTICS_ENDPOINT.format(license_id))
+    try:
+        response = http_client.get(LICENSE_STATISTICS_ENDPOINT.format(license_id))
+
+    except requests.RequestException as e:
+        logger.error('Error retrieving usage records: {}'.format(e))
+        return
 
     if response.status_code != 200:
 
@@ -148,18 +165,60 @@ def retrieve_usage_records(license_id):
     return response.json()
 
 
+def active_installations_key(license_id, window=None):
+
+    # The statistics only change at hour granularity, so entries are keyed by
+    # license and hour and expire with their hour
+
+    if window is None:
+        window = int(time.time() // 3600)
+
+    return ACTIVE_INSTALLATIONS_CACHE_KEY.format(license_id, window)
+
+
 def retrieve_active_installations(license_id):
 
+    cache = caches[settings.LICENSE_CACHE]
+    key = active_installations_key(license_id)
+
+    installations = cache.get(key)
+
+    if installations is not None:
+        active_installations_stats.hit()
+        return installations
+
+    active_installations_stats.miss()
+
+    installations = fetch_active_installations(license_id)
+
+    if installations is not None:
+        cache.set(key, installations, 3600 - time.time() % 3600)
+
+    return installations
+
+
+def invalidate_active_installations(license_id):
+
+    caches[settings.LICENSE_CACHE].delete(active_installations_key(license_id))
+
+
+def fetch_active_installations(license_id, hours=ACTIVE_HOURS):
+
     if settings.MOCK_LICENSE:
         return mock.mock_active_installations()
 
     payload = {
         'licenseId': license_id,
-        'hours': ACTIVE_HOURS
+        'hours': hours
     }
 
-    response = requests.get(
-        LICENSE_STATISTICS_HOURLY_ENDPOINT.format(license_id), params=payload)
+    try:
+        response = http_client.get(
+            LICENSE_STATISTICS_HOURLY_ENDPOINT.format(license_id), params=payload)
+
+    except requests.RequestException as e:
+        logger.error('Error retrieving active installation: {}'.format(e))
+        return
 
     if response.status_code != 200:
 
@@ -168,46 +227,158 @@ def retrieve_active_installations(license_id):
 
         return
 
-    return response.json().get('statistic').keys()
+    return list(response.json().get('statistic').keys())
 
 
-def sync_usage_records(license):
+def sync_usage_records(license, raw_usage_records=None):
 
-    raw_usage_records = retrieve_usage_records(license.license_id)
+    if raw_usage_records is None:
+        raw_usage_records = retrieve_usage_records(license.license_id)
 
     if not raw_usage_records:
         return
 
+    try:
+        store_usage_records(license, raw_usage_records)
+
+    except IntegrityError:
+
+        # A concurrent sync created some of the same months first
+        logger.info('Concurrent usage sync for {}, retrying'.format(license.license_id))
+        store_usage_records(license, raw_usage_records)
+
+    license.last_synced = timezone.now()
+    License.objects.filter(pk=license.pk).update(last_synced=license.last_synced)
+
+
+def store_usage_records(license, raw_usage_records):
+
+    # Diffs the remote months against all local records of the license, only
+    # new and changed months are written
+
+    existing = dict(
+        ((record.year, record.month), record)
+        for record in LicenseRecord.objects.filter(license=license)
+    )
+
+    created = []
+    changed = []
+
     for time_frame, remote_record in raw_usage_records['monthly_statistic'].iteritems():
 
         year, month = get_time_frame(time_frame)
 
-        try:
-
-            record = LicenseRecord.objects.get(license=license, year=year, month=month)
+        number_licenses = remote_record['license_generated_count']
+        details = remote_record['mac_address']
 
-            record.number_licenses = remote_record['license_generated_count']
-            record.details = remote_record['mac_address']
-            record.save()
+        record = existing.get((year, month))
 
-        except ObjectDoesNotExist:
+        if record is None:
 
-            record = LicenseRecord(
+            created.append(LicenseRecord(
                 license=license,
                 month=month,
                 year=year,
-                number_licenses=remote_record['license_generated_count'],
-                details=remote_record['mac_address']
-            )
+                number_licenses=number_licenses,
+                details=details
+            ))
+
+        elif record.number_licenses != number_licenses or record.details != details:
+
+            record.number_licenses = number_licenses
+            record.details = details
+            changed.append(record)
+
+    with transaction.atomic():
+
+        if created:
+            LicenseRecord.objects.bulk_create(created)
+
+            # bulk_create does not set primary keys on every backend
+            months = set((record.year, record.month) for record in created)
+            created = [
+                record for record in LicenseRecord.objects.filter(license=license).only(
+                    'id', 'year', 'month', 'details')
+                if (record.year, record.month) in months
+            ]
+
+        for record in changed:
+            record.save(update_fields=['number_licenses', 'details'])
+
+        # Changed months are small in number, their installations are
+        # replaced rather than diffed
+        InstallationUsage.objects.filter(record__in=changed).delete()
 
-            record.save()
+        InstallationUsage.objects.bulk_create([
+            InstallationUsage(record=record, mac=mac, count=count)
+            for record in created + changed
+            for mac, count in record.details.items()
+        ])
 
+        # bulk_create sends no signals, the counters are recounted here
+        recount_installations(license.account_id)
 
-def get_usage_records(license):
+
+def is_stale(license):
+
+    freshness = datetime.timedelta(seconds=settings.USAGE_SYNC_FRESHNESS)
+
+    return license.last_synced is None or license.last_synced < timezone.now() - freshness
+
+
+def refresh_usage_records(license_id):
+
+    # Runs in a background thread. The lock makes sure only one worker
+    # refreshes a given license, the others keep serving what is stored.
 
     try:
-        sync_usage_records(license)
-        return LicenseRecord.objects.filter(license=license).order_by('-year', '-month')
+
+        lock_key = USAGE_SYNC_LOCK_KEY.format(license_id)
+
+        with cache_lock(caches[settings.LICENSE_CACHE], lock_key, timeout=300, wait=0) as locked:
+
+            if locked:
+
+                license = License.objects.get(pk=license_id)
+
+                if is_stale(license):
+                    sync_usage_records(license)
+
+    except Exception as e:
+        logger.exception(e)
+
+    finally:
+        connection.close()
+
+
+def license_records(license):
+
+    # The details blob is kept for compatibility but never decoded on reads,
+    # installations come from their own table
+
+    return LicenseRecord.objects.filter(license=license).defer('details').annotate(
+        mac_count=Count('installations')
+    ).prefetch_related(
+        Prefetch('installations', queryset=InstallationUsage.objects.order_by('mac'))
+    ).order_by('-year', '-month')
+
+
+def get_usage_records(license, refresh=False):
+
+    # Stale records are served right away while they are refreshed in the
+    # background, records never synced before are synced inline
+
+    try:
+
+        if refresh or license.last_synced is None:
+            sync_usage_records(license)
+
+        elif is_stale(license):
+            thread = threading.Thread(target=refresh_usage_records, args=(license.pk,))
+            thread.daemon = True
+            thread.start()
+
+        return license_records(license)
 
     except (KeyError, TypeError) as e:
         logger.exception(e)
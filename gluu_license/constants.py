@@ -1 +1,12 @@
-ACTIVE_HOURS = 24
\ No newline at end of file
+ACTIVE_HOURS = 24
+
+# Installation snapshots
+HOURLY = 'H'
+DAILY = 'D'
+MONTHLY = 'M'
+
+SNAPSHOT_RESOLUTION_CHOICES = (
+    (HOURLY, 'Hourly'),
+    (DAILY, 'Daily'),
+    (MONTHLY, 'Monthly'),
+)
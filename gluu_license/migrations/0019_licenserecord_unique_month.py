@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.2 on 2026-10-18 11:20
+from __future__ import unicode_literals
+
+from django.db import migrations
+from django.db.models import Count, Max
+
+
+def remove_duplicate_records(apps, schema_editor):
+
+    # Keeps the most recently created record of every license month
+    LicenseRecord = apps.get_model('gluu_license', 'LicenseRecord')
+
+    duplicates = LicenseRecord.objects.values('license', 'year', 'month').annotate(
+        latest=Max('id'), records=Count('id')).filter(records__gt=1)
+
+    for duplicate in duplicates:
+        LicenseRecord.objects.filter(
+            license=duplicate['license'],
+            year=duplicate['year'],
+            month=duplicate['month']
+        ).exclude(id=duplicate['latest']).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gluu_license', '0018_license_is_blocked'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_records, migrations.RunPython.noop),
+        migrations.AlterUniqueTogether(
+            name='licenserecord',
+            unique_together=set([('license', 'year', 'month')]),
+        ),
+    ]
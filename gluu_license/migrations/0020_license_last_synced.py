@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.2 on 2026-10-18 11:48
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gluu_license', '0019_licenserecord_unique_month'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='license',
+            name='last_synced',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
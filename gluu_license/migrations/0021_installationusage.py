@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.2 on 2026-10-18 14:05
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def populate_installations(apps, schema_editor):
+
+    LicenseRecord = apps.get_model('gluu_license', 'LicenseRecord')
+    InstallationUsage = apps.get_model('gluu_license', 'InstallationUsage')
+
+    for record in LicenseRecord.objects.only('id', 'details').iterator():
+
+        InstallationUsage.objects.bulk_create([
+            InstallationUsage(record_id=record.id, mac=mac, count=count)
+            for mac, count in (record.details or {}).items()
+        ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gluu_license', '0020_license_last_synced'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='InstallationUsage',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('mac', models.CharField(db_index=True, max_length=100)),
+                ('count', models.IntegerField()),
+                ('record', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='installations', to='gluu_license.LicenseRecord')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='installationusage',
+            unique_together=set([('record', 'mac')]),
+        ),
+        migrations.RunPython(populate_installations, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.2 on 2026-10-18 15:10
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+import jsonfield.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gluu_license', '0021_installationusage'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='InstallationSnapshot',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('resolution', models.CharField(choices=[('H', 'Hourly'), ('D', 'Daily'), ('M', 'Monthly')], max_length=1)),
+                ('start', models.DateTimeField()),
+                ('active', models.IntegerField()),
+                ('peak', models.IntegerField()),
+                ('total', models.IntegerField()),
+                ('samples', models.IntegerField(default=1)),
+                ('macs', jsonfield.fields.JSONField(blank=True, default=list, null=True)),
+                ('license', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='snapshots', to='gluu_license.License')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='installationsnapshot',
+            unique_together=set([('license', 'resolution', 'start')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='installationsnapshot',
+            index_together=set([('resolution', 'start')]),
+        ),
+    ]
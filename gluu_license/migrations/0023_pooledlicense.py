@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.2 on 2026-10-18 16:48
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gluu_license', '0022_installationsnapshot'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PooledLicense',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('license_id', models.CharField(max_length=100, unique=True)),
+                ('license_password', models.CharField(max_length=100)),
+                ('public_password', models.CharField(max_length=100)),
+                ('public_key', models.CharField(max_length=500)),
+                ('creation_date', models.DateTimeField()),
+                ('expiration_date', models.DateTimeField()),
+            ],
+        ),
+    ]
@@ -8,6 +8,7 @@ from django.db import models
 from account.models import Account
 from payment.models import Payment
 from payment import constants
+from gluu_license.constants import SNAPSHOT_RESOLUTION_CHOICES
 
 
 class License(models.Model):
@@ -46,6 +47,41 @@ class License(models.Model):
 
     expiration_date = models.DateTimeField()
 
+    last_synced = models.DateTimeField(
+        null=True,
+        blank=True
+    )
+
+    def __str__(self):
+        return self.license_id
+
+
+class PooledLicense(models.Model):
+
+    # License acquired ahead of time by the refill_license_pool command and
+    # handed to the next account that needs one
+
+    license_id = models.CharField(
+        max_length=100,
+        unique=True
+    )
+
+    license_password = models.CharField(
+        max_length=100
+    )
+
+    public_password = models.CharField(
+        max_length=100
+    )
+
+    public_key = models.CharField(
+        max_length=500
+    )
+
+    creation_date = models.DateTimeField()
+
+    expiration_date = models.DateTimeField()
+
     def __str__(self):
         return self.license_id
 
@@ -64,13 +100,21 @@ class LicenseRecord(models.Model):
 
     details = jsonfield.JSONField()
 
+    class Meta:
+        unique_together = ('license', 'year', 'month')
+
     @property
     def total_usd(self):
         return settings.PRICE_PER_LICENSE * self.number_licenses
 
     @property
     def no_mac(self):
-        return len(self.details)
+
+        # Querysets built by license_records() annotate the count in SQL
+        if hasattr(self, 'mac_count'):
+            return self.mac_count
+
+        return self.installations.count()
 
     @property
     def paid(self):
@@ -83,3 +127,65 @@ class LicenseRecord(models.Model):
 
         except:
             return False
+
+
+class InstallationUsage(models.Model):
+
+    record = models.ForeignKey(LicenseRecord, related_name='installations')
+
+    mac = models.CharField(
+        max_length=100,
+        db_index=True
+    )
+
+    count = models.IntegerField()
+
+    class Meta:
+        unique_together = ('record', 'mac')
+
+    def __str__(self):
+        return self.mac
+
+
+class InstallationSnapshot(models.Model):
+
+    # Active installations of a license over one hour, day or month. Hourly
+    # rows are taken from oxLicense, daily and monthly rows are rolled up
+    # from the resolution below them.
+
+    license = models.ForeignKey(License, related_name='snapshots')
+
+    resolution = models.CharField(
+        max_length=1,
+        choices=SNAPSHOT_RESOLUTION_CHOICES
+    )
+
+    start = models.DateTimeField()
+
+    # Distinct MACs active during the period
+    active = models.IntegerField()
+
+    # Highest and summed hourly counts, with samples they give the average
+    peak = models.IntegerField()
+
+    total = models.IntegerField()
+
+    samples = models.IntegerField(
+        default=1
+    )
+
+    # Sorted MACs of daily and monthly rows, null once the row is
+    # downsampled. Hourly rows only keep the counts.
+    macs = jsonfield.JSONField(
+        null=True,
+        blank=True,
+        default=list
+    )
+
+    class Meta:
+        unique_together = ('license', 'resolution', 'start')
+        index_together = [('resolution', 'start')]
+
+    @property
+    def average(self):
+        return float(self.total) / self.samples if self.samples else 0
@@ -0,0 +1,125 @@
+import logging
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import IntegrityError, connection, transaction
+from django.utils import timezone
+
+from gluu_ecommerce.cache import cache_lock
+from gluu_ecommerce.utils import get_pool, run_task
+from gluu_license.connectors.license_interface import acquire_license, update_license_status
+from gluu_license.models import License, PooledLicense
+
+logger = logging.getLogger('django')
+
+POOL_REFILL_LOCK_KEY = 'license:pool-refill'
+
+LICENSE_FIELDS = (
+    'license_id', 'license_password', 'public_password', 'public_key',
+    'creation_date', 'expiration_date'
+)
+
+
+def refill_pool(low_watermark, target):
+
+    # Only one refill runs at a time, so concurrent runs do not acquire more
+    # licenses than the pool needs
+
+    cache = caches[settings.LICENSE_CACHE]
+    acquired = 0
+
+    with cache_lock(cache, POOL_REFILL_LOCK_KEY, timeout=600, wait=0) as locked:
+
+        if not locked:
+            return acquired
+
+        available = PooledLicense.objects.count()
+
+        if available >= low_watermark:
+            return acquired
+
+        while available + acquired < target:
+
+            license = acquire_license(settings.LICENSE_POOL_NAME)
+
+            if not license:
+                logger.error('Stopped refilling the license pool, acquisition failed')
+                break
+
+            try:
+                PooledLicense.objects.create(**dict((field, license[field]) for field in LICENSE_FIELDS))
+
+            except IntegrityError:
+                logger.error('License {} is already pooled'.format(license['license_id']))
+                break
+
+            acquired += 1
+
+    return acquired
+
+
+def next_pooled_license():
+
+    # Oldest license first. Rows locked by another transaction are skipped
+    # where the database supports it, elsewhere the row lock makes
+    # concurrent claims wait for each other.
+
+    if connection.vendor == 'postgresql':
+
+        pooled = list(PooledLicense.objects.raw(
+            'SELECT * FROM {} ORDER BY id LIMIT 1 FOR UPDATE SKIP LOCKED'.format(
+                PooledLicense._meta.db_table)))
+
+        return pooled[0] if pooled else None
+
+    return PooledLicense.objects.select_for_update().order_by('id').first()
+
+
+def push_license(license_id):
+
+    # Replaces the pool's name and dates on oxLicense with the account's,
+    # runs on the shared pool so the dashboard does not wait for it
+
+    try:
+        update_license_status(License.objects.select_related('account').get(pk=license_id))
+
+    except Exception as e:
+        logger.exception('Failed to update pooled license {} on oxLicense: {}'.format(license_id, e))
+
+
+def provision_license(account):
+
+    # Takes a license from the pool and falls back to acquiring one from
+    # oxLicense when the pool is empty. The pooled row is only removed if the
+    # account's license is stored in the same transaction.
+
+    with transaction.atomic():
+
+        pooled = next_pooled_license()
+
+        if pooled is not None:
+
+            # The license's term starts when it is claimed, not when it was
+            # acquired for the pool
+            now = timezone.now()
+            pooled.expiration_date = now + (pooled.expiration_date - pooled.creation_date)
+            pooled.creation_date = now
+
+            license = License.objects.create(
+                account=account, **dict((field, getattr(pooled, field)) for field in LICENSE_FIELDS))
+            pooled.delete()
+
+            transaction.on_commit(
+                lambda: get_pool().apply_async(run_task, (push_license, (license.pk,))))
+
+            return license
+
+    logger.info('License pool is empty, acquiring a license for {}'.format(account))
+
+    license = acquire_license(account.get_name())
+
+    if not license:
+        return
+
+    return License.objects.create(
+        account=account, **dict((field, license[field]) for field in LICENSE_FIELDS))
@@ -0,0 +1,241 @@
+import datetime
+import logging
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+from gluu_license import constants
+from gluu_license.connectors.license_interface import fetch_active_installations
+from gluu_license.models import InstallationSnapshot, License
+
+logger = logging.getLogger('django')
+
+# Resolution each one is rolled up from
+ROLLUP_SOURCE = {
+    constants.DAILY: constants.HOURLY,
+    constants.MONTHLY: constants.DAILY,
+}
+
+
+def period_start(moment, resolution):
+
+    start = moment.replace(minute=0, second=0, microsecond=0)
+
+    if resolution in (constants.DAILY, constants.MONTHLY):
+        start = start.replace(hour=0)
+
+    if resolution == constants.MONTHLY:
+        start = start.replace(day=1)
+
+    return start
+
+
+def next_period(start, resolution):
+
+    if resolution == constants.HOURLY:
+        return start + datetime.timedelta(hours=1)
+
+    if resolution == constants.DAILY:
+        return start + datetime.timedelta(days=1)
+
+    return (start + datetime.timedelta(days=32)).replace(day=1)
+
+
+def previous_period(start, resolution):
+
+    if resolution == constants.HOURLY:
+        return start - datetime.timedelta(hours=1)
+
+    if resolution == constants.DAILY:
+        return start - datetime.timedelta(days=1)
+
+    return (start - datetime.timedelta(days=1)).replace(day=1)
+
+
+def take_snapshot(license_id):
+
+    # Runs in a worker thread, once an hour. The hourly row only counts the
+    # MACs oxLicense saw during the last hour, the MACs themselves are merged
+    # into the row of the day so it can count distinct installations.
+
+    try:
+
+        license = License.objects.get(pk=license_id)
+        macs = fetch_active_installations(license.license_id, hours=1)
+
+        if macs is None:
+            return False
+
+        now = timezone.now()
+
+        with transaction.atomic():
+
+            InstallationSnapshot.objects.update_or_create(
+                license=license,
+                resolution=constants.HOURLY,
+                start=period_start(now, constants.HOURLY),
+                defaults={
+                    'active': len(macs),
+                    'peak': len(macs),
+                    'total': len(macs),
+                    'samples': 1,
+                    'macs': None
+                }
+            )
+
+            merge_macs(license, period_start(now, constants.DAILY), macs)
+
+        return True
+
+    except Exception as e:
+        logger.exception('Failed to snapshot installations of license {}: {}'.format(license_id, e))
+        return False
+
+    finally:
+        connection.close()
+
+
+def merge_macs(license, start, macs):
+
+    # Counts are filled in by the rollup of the day
+    InstallationSnapshot.objects.get_or_create(
+        license=license,
+        resolution=constants.DAILY,
+        start=start,
+        defaults={'active': 0, 'peak': 0, 'total': 0, 'samples': 0, 'macs': []}
+    )
+
+    snapshot = InstallationSnapshot.objects.select_for_update().get(
+        license=license, resolution=constants.DAILY, start=start)
+
+    snapshot.macs = sorted(set(snapshot.macs or []) | set(macs))
+    snapshot.active = len(snapshot.macs)
+    snapshot.save(update_fields=['macs', 'active'])
+
+
+def rollup(resolution, start):
+
+    # Aggregates the rows of the resolution below into one row per license.
+    # Safe to run repeatedly, rows of periods still in progress are updated
+    # on the next run.
+
+    end = next_period(start, resolution)
+
+    sources = InstallationSnapshot.objects.filter(
+        resolution=ROLLUP_SOURCE[resolution],
+        start__gte=start,
+        start__lt=end
+    ).order_by('license', 'start')
+
+    aggregates = {}
+
+    for source in sources.iterator():
+
+        aggregate = aggregates.setdefault(source.license_id, {
+            'macs': set(), 'active': 0, 'peak': 0, 'total': 0, 'samples': 0, 'complete': True})
+
+        aggregate['macs'].update(source.macs or [])
+        aggregate['active'] = max(aggregate['active'], source.active)
+        aggregate['peak'] = max(aggregate['peak'], source.peak)
+        aggregate['total'] += source.total
+        aggregate['samples'] += source.samples
+
+        # Downsampled sources no longer carry their MACs
+        if source.macs is None:
+            aggregate['complete'] = False
+
+    existing = dict(
+        (snapshot.license_id, snapshot)
+        for snapshot in InstallationSnapshot.objects.filter(resolution=resolution, start=start)
+    )
+
+    created = []
+    changed = []
+
+    for license_id, aggregate in aggregates.items():
+
+        macs = sorted(aggregate['macs']) if aggregate['complete'] else None
+
+        values = {
+            'active': len(macs) if aggregate['complete'] else aggregate['active'],
+            'peak': aggregate['peak'],
+            'total': aggregate['total'],
+            'samples': aggregate['samples'],
+            'macs': macs
+        }
+
+        snapshot = existing.get(license_id)
+
+        # Daily MACs were merged in as the hourly snapshots were taken
+        if resolution == constants.DAILY and snapshot is not None:
+            del values['active'], values['macs']
+
+        if snapshot is None:
+            created.append(InstallationSnapshot(
+                license_id=license_id, resolution=resolution, start=start, **values))
+
+        else:
+            for field, value in values.items():
+                setattr(snapshot, field, value)
+            changed.append((snapshot, list(values)))
+
+    with transaction.atomic():
+
+        InstallationSnapshot.objects.bulk_create(created)
+
+        for snapshot, fields in changed:
+            snapshot.save(update_fields=fields)
+
+    return len(created) + len(changed)
+
+
+def rollup_recent(now=None):
+
+    # Rolls up the current and the previous day and month, so periods are
+    # closed on the first run after they end
+
+    now = now or timezone.now()
+
+    for resolution in (constants.DAILY, constants.MONTHLY):
+
+        start = period_start(now, resolution)
+
+        rollup(resolution, previous_period(start, resolution))
+        rollup(resolution, start)
+
+
+def downsample(now=None):
+
+    # Hourly rows are dropped once their day has been rolled up, MAC lists
+    # are dropped from older rows so only the counts remain and daily rows
+    # are eventually dropped too. Monthly counts are kept for good.
+    # SNAPSHOT_MAC_RETENTION has to cover two months for the monthly
+    # rollup of the previous month to see every MAC.
+
+    now = now or timezone.now()
+
+    InstallationSnapshot.objects.filter(
+        resolution=constants.HOURLY,
+        start__lt=now - datetime.timedelta(days=settings.SNAPSHOT_HOURLY_RETENTION)
+    ).delete()
+
+    InstallationSnapshot.objects.filter(
+        resolution__in=[constants.DAILY, constants.MONTHLY],
+        start__lt=now - datetime.timedelta(days=settings.SNAPSHOT_MAC_RETENTION),
+        macs__isnull=False
+    ).update(macs=None)
+
+    InstallationSnapshot.objects.filter(
+        resolution=constants.DAILY,
+        start__lt=now - datetime.timedelta(days=settings.SNAPSHOT_DAILY_RETENTION)
+    ).delete()
+
+
+def installation_history(license, resolution, since):
+
+    return InstallationSnapshot.objects.filter(
+        license=license,
+        resolution=resolution,
+        start__gte=since
+    ).defer('macs').order_by('start')
@@ -7,5 +7,10 @@ urlpatterns = [
         r'^activate_license/(?P<license_id>[\w\-]+)/$',
         views.activate_license,
         name='activate'
+    ),
+    url(
+        r'^refresh_usage/(?P<license_id>[\w\-]+)/$',
+        views.refresh_usage,
+        name='refresh-usage'
     )
 ]
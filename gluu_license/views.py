@@ -30,6 +30,24 @@ def activate_license(request, license_id):
         license_interface.update_license_status(license)
         license.save()
 
+        license_interface.invalidate_active_installations(license.license_id)
+
+        return HttpResponseRedirect(reverse('account:dashboard'))
+
+    except Exception as e:
+        logger.error(e)
+        return HttpResponseServerError(e)
+
+
+@login_required
+def refresh_usage(request, license_id):
+
+    try:
+
+        license = models.License.objects.get(license_id=license_id, account=request.user.account)
+
+        license_interface.get_usage_records(license, refresh=True)
+
         return HttpResponseRedirect(reverse('account:dashboard'))
 
     except Exception as e:
@@ -29,3 +29,30 @@ class PaymentAdmin(admin.ModelAdmin):
     )
 
 admin.site.register(models.Payment, PaymentAdmin)
+
+
+class BillingCheckpointInlineAdmin(admin.TabularInline):
+    model = models.BillingCheckpoint
+    extra = 0
+    raw_id_fields = ('account',)
+    readonly_fields = ('finished',)
+
+
+class BillingRunAdmin(admin.ModelAdmin):
+
+    model = models.BillingRun
+    list_display = ('id', 'command', 'month', 'year', 'started', 'finished')
+    list_filter = ('command',)
+    inlines = [BillingCheckpointInlineAdmin, ]
+
+admin.site.register(models.BillingRun, BillingRunAdmin)
+
+
+class StripeEventAdmin(admin.ModelAdmin):
+
+    model = models.StripeEvent
+    list_display = ('id', 'event_id', 'type', 'status', 'attempts', 'received', 'processed')
+    list_filter = ('status', 'type')
+    search_fields = ('event_id',)
+
+admin.site.register(models.StripeEvent, StripeEventAdmin)
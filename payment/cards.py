@@ -0,0 +1,69 @@
+from django.db import transaction
+
+from payment import gateway
+from payment.models import StripeCard
+
+CARD_FIELDS = (
+    'brand', 'last4', 'name', 'address_line1', 'address_line2',
+    'address_city', 'address_state', 'address_zip', 'address_country'
+)
+
+
+def card_details(source):
+
+    details = dict((field, source.get(field) or '') for field in CARD_FIELDS)
+    details['exp_month'] = source.get('exp_month')
+    details['exp_year'] = source.get('exp_year')
+
+    return details
+
+
+def store_card(stripe_customer, source, is_primary):
+
+    card, created = StripeCard.objects.update_or_create(
+        card_id=source['id'],
+        defaults=dict(customer=stripe_customer, is_primary=is_primary, **card_details(source))
+    )
+
+    return card
+
+
+def store_cards(stripe_customer, customer):
+
+    # Mirrors every card of a Stripe customer, local cards Stripe no longer
+    # has are removed
+
+    with transaction.atomic():
+
+        card_ids = []
+        default_source = gateway.default_source_id(customer)
+
+        for source in gateway.iter_cards(customer):
+            store_card(stripe_customer, source, source['id'] == default_source)
+            card_ids.append(source['id'])
+
+        stripe_customer.cards.exclude(card_id__in=card_ids).delete()
+
+
+def sync_cards(stripe_customer):
+
+    store_cards(stripe_customer, gateway.retrieve_customer(stripe_customer.customer_id))
+
+
+def serialize_card(card):
+
+    details = dict((field, getattr(card, field)) for field in CARD_FIELDS)
+    details.update({
+        'id': card.card_id,
+        'exp_month': card.exp_month,
+        'exp_year': card.exp_year,
+        'is_primary': card.is_primary
+    })
+
+    return details
+
+
+def primary_card_last4(account):
+
+    return StripeCard.objects.filter(
+        customer__account=account, is_primary=True).values_list('last4', flat=True).first()
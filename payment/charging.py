@@ -0,0 +1,177 @@
+import datetime
+import logging
+import random
+import time
+import uuid
+
+from collections import Counter
+from multiprocessing.pool import ThreadPool
+
+import stripe
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Q
+from django.utils import timezone
+
+from gluu_ecommerce.utils import TokenBucket
+from payment import gateway
+from payment.models import Payment
+
+logger = logging.getLogger('billing')
+
+# Outcomes counted by run_charges
+CHARGED = 'charged'
+NOTHING_DUE = 'nothing due'
+DECLINED = 'declined'
+NO_CARD = 'no card'
+ERROR = 'error'
+
+_bucket = TokenBucket(settings.STRIPE_RATE_LIMIT)
+
+
+def idempotency_key(kind, invoice_id):
+
+    # Stable per invoice and attempt kind, a charge replayed by a crashed or
+    # rerun command returns the original charge instead of a new one
+    return '{}:{}'.format(kind, invoice_id)
+
+
+def is_transient(error):
+
+    if isinstance(error, (stripe.error.RateLimitError, stripe.error.APIConnectionError)):
+        return True
+
+    return isinstance(error, stripe.error.APIError) and (error.http_status or 500) >= 500
+
+
+def charge(key, **params):
+
+    # Retrying is safe because every attempt carries the same idempotency key
+
+    attempt = 0
+
+    while True:
+
+        _bucket.acquire()
+
+        try:
+            return gateway.charge(idempotency_key=key, **params)
+
+        except stripe.error.StripeError as e:
+
+            if not is_transient(e) or attempt >= settings.STRIPE_MAX_RETRIES:
+                raise
+
+            delay = random.uniform(0, settings.STRIPE_RETRY_DELAY * 2 ** attempt)
+            attempt += 1
+
+            logger.info('Retrying charge {} in {:.2f}s: {}'.format(key, delay, e))
+            time.sleep(delay)
+
+
+def charge_invoice(kind, payment, replayed, **params):
+
+    # Stripe keeps idempotency keys for 24 hours only. A replayed payment,
+    # whose earlier attempt may have been charged, first looks for a
+    # successful charge of its invoice instead of relying on the key.
+
+    if replayed:
+
+        existing = gateway.find_charge(params['customer'], payment.invoice_id, payment.created)
+
+        if existing is not None:
+            logger.info('Invoice {} was already charged by {}'.format(payment.invoice_id, existing.id))
+            return existing
+
+    return charge(idempotency_key(kind, payment.invoice_id), **params)
+
+
+def run_payment(process, payment_id):
+
+    try:
+        return process(payment_id)
+
+    except Exception as e:
+        logger.exception(e)
+        logger.error('Billing failed: payment {}, {}'.format(payment_id, e))
+        return ERROR
+
+    finally:
+        connection.close()
+
+
+def run_charges(payment_ids, process, workers=None):
+
+    # Runs `process` for every payment on a bounded pool and counts the
+    # outcomes it returns
+
+    outcomes = Counter()
+    pool = ThreadPool(max(workers or settings.STRIPE_CHARGE_WORKERS, 1))
+
+    try:
+
+        for outcome in pool.imap_unordered(
+                lambda payment_id: run_payment(process, payment_id), payment_ids):
+            outcomes[outcome] += 1
+
+    finally:
+        pool.close()
+        pool.join()
+
+    return outcomes
+
+
+def claim_payments(payments, batch_size):
+
+    # Claims up to batch_size of the payments for this worker. The
+    # conditional update is atomic per row, so payments another worker
+    # claimed in between are left out. Leases of crashed workers expire and
+    # their payments are claimed again.
+
+    now = timezone.now()
+    owner = uuid.uuid4().hex
+
+    available = payments.filter(Q(lease_until__isnull=True) | Q(lease_until__lte=now))
+    candidates = list(available.order_by('id').values_list('pk', flat=True)[:batch_size])
+
+    if not candidates:
+        return []
+
+    available.filter(pk__in=candidates).update(
+        lease_until=now + datetime.timedelta(seconds=settings.STRIPE_CHARGE_LEASE),
+        lease_owner=owner
+    )
+
+    return list(Payment.objects.filter(lease_owner=owner).values_list('pk', flat=True))
+
+
+def release(payment, *fields):
+
+    # Saves the given fields and returns the payment to the pool right away
+    # instead of waiting for its lease to expire
+
+    payment.lease_until = None
+    payment.lease_owner = ''
+    payment.save(update_fields=list(fields) + ['lease_until', 'lease_owner'])
+
+
+def drain(payments, process, workers=None, batch_size=None):
+
+    # Claims and charges batches until no payment is left to claim. Any
+    # number of workers can drain the same payments concurrently. Payments
+    # released by this drain are left for the next one.
+
+    workers = max(workers or settings.STRIPE_CHARGE_WORKERS, 1)
+    outcomes = Counter()
+    processed = set()
+
+    while True:
+
+        payment_ids = claim_payments(payments.exclude(pk__in=processed), batch_size or workers * 5)
+
+        if not payment_ids:
+            return outcomes
+
+        processed.update(payment_ids)
+        outcomes.update(run_charges(payment_ids, process, workers))
@@ -7,3 +7,25 @@ PAYMENT_STATUS_CHOICES = (
     (PAID, 'Paid'),
     (FAILED, 'Failed'),
 )
+
+# Billing runs
+CHECKPOINT_DONE = 'DONE'
+CHECKPOINT_SKIPPED = 'SKIP'
+CHECKPOINT_FAILED = 'FAIL'
+
+CHECKPOINT_STATUS_CHOICES = (
+    (CHECKPOINT_DONE, 'Done'),
+    (CHECKPOINT_SKIPPED, 'Skipped'),
+    (CHECKPOINT_FAILED, 'Failed'),
+)
+
+# Stripe webhook events
+EVENT_PENDING = 'PEND'
+EVENT_DONE = 'DONE'
+EVENT_FAILED = 'FAIL'
+
+EVENT_STATUS_CHOICES = (
+    (EVENT_PENDING, 'Pending'),
+    (EVENT_DONE, 'Done'),
+    (EVENT_FAILED, 'Failed'),
+)
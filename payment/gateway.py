@@ -0,0 +1,133 @@
+import calendar
+import logging
+import os
+import re
+import time
+
+import stripe
+
+from stripe.http_client import RequestsClient
+
+from django.conf import settings
+
+from gluu_ecommerce.connectors import http_client
+from gluu_ecommerce.utils import LatencyStats
+
+logger = logging.getLogger('billing')
+
+# Every Stripe call goes through this module. Calls share one keep-alive
+# session and their latency is recorded per endpoint.
+
+CA_BUNDLE = os.path.join(os.path.dirname(stripe.__file__), 'data', 'ca-certificates.crt')
+
+# Object ids are replaced so calls are grouped by endpoint
+OBJECT_ID = re.compile(r'/[a-z]+_[A-Za-z0-9]+')
+
+latencies = LatencyStats()
+
+
+class StripeSessionClient(RequestsClient):
+
+    name = 'requests-session'
+
+    def request(self, method, url, headers, post_data=None):
+
+        start = time.time()
+
+        try:
+            response = http_client.request(
+                method, url, headers=headers, data=post_data, verify=CA_BUNDLE)
+
+            content = response.content
+
+        except Exception as e:
+            self._handle_request_error(e)
+
+        finally:
+            latencies.record(
+                '{} {}'.format(method.upper(), OBJECT_ID.sub('/{id}', url.split('?')[0])),
+                time.time() - start
+            )
+
+        return content, response.status_code, response.headers
+
+
+stripe.api_key = settings.STRIPE_API_KEY
+stripe.default_http_client = StripeSessionClient()
+
+
+def retrieve_customer(customer_id):
+
+    # The default source comes back expanded, no second call is needed
+    return stripe.Customer.retrieve(customer_id, expand=['default_source'])
+
+
+def default_source_id(customer):
+
+    source = customer.default_source
+
+    if isinstance(source, dict):
+        return source['id']
+
+    return source
+
+
+def create_customer(token):
+    return stripe.Customer.create(source=token, expand=['default_source'])
+
+
+def customer_sources(customer_id):
+
+    # The sources list of a customer, without retrieving the customer
+    return stripe.ListObject.construct_from({
+        'object': 'list',
+        'url': '/v1/customers/{}/sources'.format(customer_id),
+        'data': []
+    }, stripe.api_key)
+
+
+def add_card(customer_id, token):
+    return customer_sources(customer_id).create(source=token)
+
+
+def set_default_source(customer_id, card_id):
+    return stripe.Customer.modify(customer_id, default_source=card_id)
+
+
+def delete_card(customer_id, card_id):
+
+    card = stripe.Card.construct_from(
+        {'id': card_id, 'customer': customer_id, 'object': 'card'}, stripe.api_key)
+
+    return card.delete()
+
+
+def charge(idempotency_key=None, **params):
+    return stripe.Charge.create(idempotency_key=idempotency_key, **params)
+
+
+def find_charge(customer_id, invoice_id, since):
+
+    # The successful charge of an invoice, looked up by its metadata
+
+    charges = stripe.Charge.list(
+        customer=customer_id, created={'gte': calendar.timegm(since.utctimetuple())}, limit=100)
+
+    for charge in charges.auto_paging_iter():
+        if charge.paid and charge.metadata.get('invoice_id') == invoice_id:
+            return charge
+
+
+def iter_customers():
+    return stripe.Customer.list(limit=100).auto_paging_iter()
+
+
+def iter_cards(customer):
+
+    # Customers come with their first sources embedded, the rest are paged
+    sources = customer.sources
+
+    if getattr(sources, 'has_more', False):
+        sources = customer_sources(customer.id).list(object='card', limit=100).auto_paging_iter()
+
+    return (source for source in sources if source.get('object') == 'card')
@@ -0,0 +1,186 @@
+import logging
+
+from collections import defaultdict
+from random import randint
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, FloatField, Value, When
+from django.utils import timezone
+
+from account.counters import invalidate_counters
+from account.models import Account, Credit
+from gluu_license.models import InstallationUsage, LicenseRecord
+from payment import constants
+from payment.models import BillingCheckpoint, Payment
+from payment.runs import pending_accounts
+
+logger = logging.getLogger('billing')
+
+
+def invoice_ids(count):
+
+    # Random like the ids of single invoices, unique within the batch and
+    # against the stored payments
+
+    ids = set()
+
+    while len(ids) < count:
+        ids.update(str(randint(100000000, 999999999)) for i in range(count - len(ids)))
+        ids -= set(Payment.objects.filter(invoice_id__in=ids).values_list('invoice_id', flat=True))
+
+    return list(ids)
+
+
+def generate_invoices(run, accounts, month, year, batch_size=1000, notify=None):
+
+    # Creates the month's payments of all pending accounts a batch at a time:
+    # the records, installations and credits of a batch are read in three
+    # queries, payments and checkpoints are inserted in bulk and credits are
+    # drawn down in a single update. `notify` is called with the payments
+    # and records of each batch once it is committed. Returns how many
+    # accounts ended in each status, the run is closed once none failed.
+
+    account_ids = list(pending_accounts(run, accounts).order_by('pk').values_list('pk', flat=True))
+    results = dict((status, 0) for status, name in constants.CHECKPOINT_STATUS_CHOICES)
+
+    for start in range(0, len(account_ids), batch_size):
+
+        batch = account_ids[start:start + batch_size]
+
+        try:
+            invoices, done = generate_batch(run, batch, month, year)
+
+        except Exception as e:
+            logger.exception(e)
+            logger.error('Billing failed: accounts {} to {}, {}'.format(batch[0], batch[-1], e))
+            fail_batch(run, batch, e)
+            results[constants.CHECKPOINT_FAILED] += len(batch)
+            continue
+
+        results[constants.CHECKPOINT_DONE] += done
+        results[constants.CHECKPOINT_SKIPPED] += len(batch) - done
+
+        if notify is not None:
+            notify(invoices)
+
+    if not results[constants.CHECKPOINT_FAILED]:
+        run.finished = timezone.now()
+        run.save(update_fields=['finished'])
+
+    return results
+
+
+def generate_batch(run, account_ids, month, year):
+
+    with transaction.atomic():
+
+        # Accounts billed by another run, e.g. one of a different shard
+        # layout, keep their payment. The account locks keep runs from
+        # billing them at the same time.
+        list(Account.objects.select_for_update().filter(pk__in=account_ids).values_list('pk', flat=True))
+
+        billed = set(Payment.objects.filter(
+            account_id__in=account_ids, month=month, year=year).values_list('account_id', flat=True))
+
+        records = dict(
+            (record.license.account_id, record)
+            for record in LicenseRecord.objects.filter(
+                license__account_id__in=account_ids, month=month, year=year
+            ).exclude(license__account_id__in=billed).select_related('license__account').defer('details')
+        )
+
+        details = defaultdict(dict)
+
+        for record_id, mac, count in InstallationUsage.objects.filter(
+                record__in=records.values()).values_list('record_id', 'mac', 'count'):
+            details[record_id][mac] = [count, count * settings.PRICE_PER_LICENSE]
+
+        # For now, we only support one valid credit object at a time
+        credits = defaultdict(list)
+
+        for credit in Credit.objects.select_for_update().filter(
+                account_id__in=records.keys(),
+                expires__gt=timezone.now(),
+                remaining_amount__gt=0.00):
+            credits[credit.account_id].append(credit)
+
+        # Payments are built here rather than with an INSERT ... SELECT: the
+        # invoice ids are random, the details are JSON assembled from the
+        # installations and the credit rule needs the account's credits, none
+        # of which jsonfield and the supported databases can do in one
+        # statement. Every read and write above and below stays per batch.
+        payments = []
+        remaining = {}
+
+        for (account_id, record), invoice_id in zip(sorted(records.items()), invoice_ids(len(records))):
+
+            payment = Payment(
+                invoice_id=invoice_id,
+                account=record.license.account,
+                amount=record.total_usd,
+                details=details[record.id],
+                month=month,
+                year=year
+            )
+
+            if len(credits[account_id]) == 1:
+
+                credit = credits[account_id][0]
+                payment.credits_used = min(credit.remaining_amount, record.total_usd)
+                remaining[credit.pk] = credit.remaining_amount - payment.credits_used
+
+            payments.append(payment)
+
+        Payment.objects.bulk_create(payments)
+
+        if remaining:
+            Credit.objects.filter(pk__in=remaining.keys()).update(remaining_amount=Case(
+                *[When(pk=pk, then=Value(amount)) for pk, amount in remaining.items()],
+                output_field=FloatField()
+            ))
+
+        replace_checkpoints(run, [
+            checkpoint_for(run, account_id, account_id in records or account_id in billed, month, year)
+            for account_id in account_ids
+        ])
+
+        invalidate_counters(account_ids)
+
+    logger.info('Generated {} invoices for {} accounts'.format(len(payments), len(account_ids)))
+
+    invoices = [(payment, records[payment.account_id]) for payment in payments]
+
+    return invoices, len(records) + len(billed)
+
+
+def fail_batch(run, account_ids, error):
+
+    with transaction.atomic():
+        replace_checkpoints(run, [
+            BillingCheckpoint(
+                run=run, account_id=account_id, status=constants.CHECKPOINT_FAILED, error=str(error))
+            for account_id in account_ids
+        ])
+
+
+def replace_checkpoints(run, checkpoints):
+
+    # Replaces the checkpoints of accounts that failed on a previous attempt
+    BillingCheckpoint.objects.filter(
+        run=run, account_id__in=[checkpoint.account_id for checkpoint in checkpoints]).delete()
+
+    BillingCheckpoint.objects.bulk_create(checkpoints)
+
+
+def checkpoint_for(run, account_id, billed, month, year):
+
+    if billed:
+        return BillingCheckpoint(run=run, account_id=account_id, status=constants.CHECKPOINT_DONE)
+
+    return BillingCheckpoint(
+        run=run,
+        account_id=account_id,
+        status=constants.CHECKPOINT_SKIPPED,
+        error='No license record for {}/{}'.format(month, year)
+    )
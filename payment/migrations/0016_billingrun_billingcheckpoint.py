@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.2 on 2026-10-18 17:30
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('account', '0032_billingcounters'),
+        ('payment', '0015_auto_20161118_2254'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BillingRun',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('command', models.CharField(max_length=50)),
+                ('month', models.IntegerField()),
+                ('year', models.IntegerField()),
+                ('started', models.DateTimeField(auto_now_add=True)),
+                ('finished', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='BillingCheckpoint',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('DONE', 'Done'), ('SKIP', 'Skipped'), ('FAIL', 'Failed')], max_length=4)),
+                ('error', models.TextField(blank=True)),
+                ('finished', models.DateTimeField(auto_now=True)),
+                ('account', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='billing_checkpoints', to='account.Account')),
+                ('run', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='checkpoints', to='payment.BillingRun')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='billingrun',
+            unique_together=set([('command', 'year', 'month')]),
+        ),
+        migrations.AlterUniqueTogether(
+            name='billingcheckpoint',
+            unique_together=set([('run', 'account')]),
+        ),
+    ]
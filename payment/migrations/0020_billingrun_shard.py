@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.2 on 2026-10-18 20:50
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payment', '0019_payment_lease'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='billingrun',
+            name='shard',
+            field=models.CharField(blank=True, max_length=20),
+        ),
+        migrations.AlterUniqueTogether(
+            name='billingrun',
+            unique_together=set([('command', 'year', 'month', 'shard')]),
+        ),
+    ]
@@ -3,9 +3,11 @@ from __future__ import unicode_literals
 import jsonfield
 
 from django.db import models
+from django.utils import timezone
 
 from account.models import Account
 from payment import constants
+from payment.utils import is_expired
 
 
 class StripeCustomer(models.Model):
@@ -37,6 +39,74 @@ class StripeCard(models.Model):
         default=True
     )
 
+    # Mirror of the Stripe card, written whenever the card is added or
+    # changed so reads never go to Stripe. is_primary mirrors the customer's
+    # default source.
+
+    brand = models.CharField(
+        max_length=50,
+        blank=True
+    )
+
+    last4 = models.CharField(
+        max_length=4,
+        blank=True
+    )
+
+    exp_month = models.IntegerField(
+        null=True,
+        blank=True
+    )
+
+    exp_year = models.IntegerField(
+        null=True,
+        blank=True
+    )
+
+    name = models.CharField(
+        max_length=200,
+        blank=True
+    )
+
+    address_line1 = models.CharField(
+        max_length=200,
+        blank=True
+    )
+
+    address_line2 = models.CharField(
+        max_length=200,
+        blank=True
+    )
+
+    address_city = models.CharField(
+        max_length=100,
+        blank=True
+    )
+
+    address_state = models.CharField(
+        max_length=100,
+        blank=True
+    )
+
+    address_zip = models.CharField(
+        max_length=20,
+        blank=True
+    )
+
+    address_country = models.CharField(
+        max_length=100,
+        blank=True
+    )
+
+    @property
+    def is_expired(self):
+
+        if not self.exp_year or not self.exp_month:
+            return False
+
+        # Stripe sends four digit years, is_expired takes two like the card form
+        return is_expired(self.exp_year % 100, self.exp_month)
+
 
 class Payment(models.Model):
 
@@ -79,6 +149,134 @@ class Payment(models.Model):
 
     year = models.IntegerField()
 
+    # Charges made for this payment, the retry run only picks up payments
+    # charged once
+    charge_attempts = models.IntegerField(default=0)
+
+    # Set while a charging worker holds the payment, expired leases of
+    # crashed workers are claimed again
+    lease_until = models.DateTimeField(
+        null=True,
+        blank=True
+    )
+
+    lease_owner = models.CharField(
+        max_length=32,
+        blank=True
+    )
+
+    class Meta:
+        index_together = [('status', 'lease_until')]
+
     @property
     def paid_amount(self):
         return self.amount - self.credits_used
+
+
+class BillingRun(models.Model):
+
+    # One run of a monthly billing command. Accounts are checkpointed as they
+    # finish so an interrupted run resumes where it stopped.
+
+    command = models.CharField(
+        max_length=50
+    )
+
+    month = models.IntegerField()
+
+    year = models.IntegerField()
+
+    # INDEX/COUNT of a sharded run, every shard is resumed on its own
+    shard = models.CharField(
+        max_length=20,
+        blank=True
+    )
+
+    started = models.DateTimeField(
+        auto_now_add=True
+    )
+
+    finished = models.DateTimeField(
+        null=True,
+        blank=True
+    )
+
+    class Meta:
+        unique_together = ('command', 'year', 'month', 'shard')
+
+    def __str__(self):
+
+        if self.shard:
+            return '{} {}/{} shard {}'.format(self.command, self.month, self.year, self.shard)
+
+        return '{} {}/{}'.format(self.command, self.month, self.year)
+
+
+class BillingCheckpoint(models.Model):
+
+    run = models.ForeignKey(
+        BillingRun,
+        related_name='checkpoints'
+    )
+
+    account = models.ForeignKey(
+        Account,
+        related_name='billing_checkpoints'
+    )
+
+    status = models.CharField(
+        max_length=4,
+        choices=constants.CHECKPOINT_STATUS_CHOICES
+    )
+
+    error = models.TextField(blank=True)
+
+    finished = models.DateTimeField(
+        auto_now=True
+    )
+
+    class Meta:
+        unique_together = ('run', 'account')
+
+
+class StripeEvent(models.Model):
+
+    # Webhook event received from Stripe. The unique event id drops
+    # redeliveries, events are applied by payment.webhooks after the
+    # webhook has responded.
+
+    event_id = models.CharField(
+        max_length=100,
+        unique=True
+    )
+
+    type = models.CharField(
+        max_length=100
+    )
+
+    payload = jsonfield.JSONField()
+
+    status = models.CharField(
+        max_length=4,
+        choices=constants.EVENT_STATUS_CHOICES,
+        default=constants.EVENT_PENDING
+    )
+
+    attempts = models.IntegerField(default=0)
+
+    next_attempt = models.DateTimeField(default=timezone.now)
+
+    last_error = models.TextField(blank=True)
+
+    received = models.DateTimeField(auto_now_add=True)
+
+    processed = models.DateTimeField(
+        null=True,
+        blank=True
+    )
+
+    class Meta:
+        index_together = [('status', 'next_attempt')]
+
+    def __str__(self):
+        return '{} {}'.format(self.type, self.event_id)
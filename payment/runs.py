@@ -0,0 +1,116 @@
+import logging
+
+from multiprocessing.pool import ThreadPool
+
+from django.core.exceptions import ObjectDoesNotExist
+from django.db import connection
+from django.db.models import F
+from django.utils import timezone
+
+from payment import constants
+from payment.models import BillingCheckpoint, BillingRun
+
+logger = logging.getLogger('billing')
+
+
+def shard_label(shard):
+    return '{}/{}'.format(*shard) if shard else ''
+
+
+def filter_shard(queryset, shard, field='pk'):
+
+    # Keeps the rows of the accounts in the shard, `field` points at the
+    # account id. Accounts are assigned by their id modulo the shard count,
+    # computed by the database. Without a shard the queryset is returned as
+    # is.
+
+    if not shard:
+        return queryset
+
+    index, count = shard
+
+    return queryset.annotate(account_shard=F(field) % count).filter(account_shard=index)
+
+
+def start_run(command, month, year, shard=None):
+
+    # Starting a run that already exists resumes it
+    run, created = BillingRun.objects.get_or_create(
+        command=command, month=month, year=year, shard=shard_label(shard))
+
+    if not created:
+        logger.info('Resuming {}'.format(run))
+
+    return run
+
+
+def pending_accounts(run, accounts):
+
+    # Failed accounts are retried when the run is resumed
+    finished = BillingCheckpoint.objects.filter(
+        run=run,
+        status__in=[constants.CHECKPOINT_DONE, constants.CHECKPOINT_SKIPPED]
+    ).values('account')
+
+    return accounts.exclude(pk__in=finished)
+
+
+def checkpoint(run_id, account_id, status, error=''):
+
+    BillingCheckpoint.objects.update_or_create(
+        run_id=run_id,
+        account_id=account_id,
+        defaults={'status': status, 'error': error}
+    )
+
+
+def process_account(process, run_id, account_id):
+
+    # Runs in a worker thread with its own database connection. `process`
+    # checkpoints the account as done in the transaction of its writes,
+    # skipped and failed accounts are checkpointed here.
+
+    try:
+        process(run_id, account_id)
+        return constants.CHECKPOINT_DONE
+
+    except ObjectDoesNotExist as e:
+        logger.info('Nothing to bill for account {}, {}'.format(account_id, e))
+        checkpoint(run_id, account_id, constants.CHECKPOINT_SKIPPED, str(e))
+        return constants.CHECKPOINT_SKIPPED
+
+    except Exception as e:
+        logger.exception(e)
+        logger.error('Billing failed: account {}, {}'.format(account_id, e))
+        checkpoint(run_id, account_id, constants.CHECKPOINT_FAILED, str(e))
+        return constants.CHECKPOINT_FAILED
+
+    finally:
+        connection.close()
+
+
+def execute_run(run, accounts, process, workers=1):
+
+    # Processes the accounts not yet finished in this run, returns how many
+    # ended in each status. The run is closed once no account failed.
+
+    account_ids = list(pending_accounts(run, accounts).values_list('pk', flat=True))
+    results = dict((status, 0) for status, name in constants.CHECKPOINT_STATUS_CHOICES)
+
+    pool = ThreadPool(max(workers, 1))
+
+    try:
+
+        for status in pool.imap_unordered(
+                lambda account_id: process_account(process, run.pk, account_id), account_ids):
+            results[status] += 1
+
+    finally:
+        pool.close()
+        pool.join()
+
+    if not results[constants.CHECKPOINT_FAILED]:
+        run.finished = timezone.now()
+        run.save(update_fields=['finished'])
+
+    return results
@@ -1,3 +1,433 @@
-from django.test import TestCase
+import calendar
+import datetime
+import hashlib
+import hmac
+import json
+import time
 
-# Create your tests here.
+import stripe
+
+from collections import Counter
+
+from django.core.urlresolvers import reverse
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from account.management.commands import monthly_charging, monthly_charging_retry
+from account.models import Account, EcommerceUser
+from payment import cards, charging, constants, gateway, webhooks
+from payment.models import Payment, StripeCard, StripeCustomer, StripeEvent
+
+
+def patch(test, target, name, value):
+
+    test.addCleanup(setattr, target, name, getattr(target, name))
+    setattr(target, name, value)
+
+
+def create_account(email='owner@example.com'):
+
+    user = EcommerceUser.objects.create_user(
+        email, 'secret', first_name='Jane', last_name='Doe', phone_number='1')
+
+    return Account.objects.create(
+        primary_contact=user, address_1='1 Main Street', city='Austin', country='US')
+
+
+def create_payment(account, invoice_id='100000001', **kwargs):
+
+    return Payment.objects.create(
+        invoice_id=invoice_id, account=account, amount=10.0, details={}, month=1, year=2016, **kwargs)
+
+
+def card(card_id, last4, customer='cus_1', **kwargs):
+
+    source = {
+        'id': card_id,
+        'object': 'card',
+        'customer': customer,
+        'brand': 'Visa',
+        'last4': last4,
+        'exp_month': 12,
+        'exp_year': 2030,
+        'name': 'Jane Doe',
+        'address_zip': '78701'
+    }
+
+    source.update(kwargs)
+    return source
+
+
+class CardMirrorTest(TestCase):
+
+    def setUp(self):
+
+        self.account = create_account()
+        self.stripe_customer = StripeCustomer.objects.create(customer_id='cus_1', account=self.account)
+
+    def test_store_cards_mirrors_customer_cards(self):
+
+        StripeCard.objects.create(card_id='card_gone', customer=self.stripe_customer)
+
+        customer = stripe.Customer.construct_from({
+            'id': 'cus_1',
+            'object': 'customer',
+            'default_source': 'card_2',
+            'sources': {
+                'object': 'list',
+                'has_more': False,
+                'data': [card('card_1', '4242'), card('card_2', '1881', address_zip=None)]
+            }
+        }, 'sk_test')
+
+        cards.store_cards(self.stripe_customer, customer)
+
+        stored = dict((c.card_id, c) for c in self.stripe_customer.cards.all())
+
+        self.assertEqual(sorted(stored), ['card_1', 'card_2'])
+        self.assertFalse(stored['card_1'].is_primary)
+        self.assertTrue(stored['card_2'].is_primary)
+        self.assertEqual(stored['card_1'].last4, '4242')
+        self.assertEqual(stored['card_1'].exp_year, 2030)
+        self.assertEqual(stored['card_2'].address_zip, '')
+
+        self.assertEqual(cards.primary_card_last4(self.account), '1881')
+
+    def test_expired_card(self):
+
+        expired = StripeCard(card_id='card_1', exp_month=1, exp_year=2000)
+        valid = StripeCard(card_id='card_2', exp_month=12, exp_year=2999)
+        unknown = StripeCard(card_id='card_3')
+
+        self.assertTrue(expired.is_expired)
+        self.assertFalse(valid.is_expired)
+        self.assertFalse(unknown.is_expired)
+
+
+@override_settings(STRIPE_WEBHOOK_SECRET='whsec_test')
+class WebhookTest(TestCase):
+
+    def post(self, event, secret='whsec_test', timestamp=None):
+
+        payload = json.dumps(event).encode('utf-8')
+        timestamp = timestamp or int(time.time())
+
+        signature = hmac.new(
+            secret.encode('utf-8'), '{}.'.format(timestamp).encode('utf-8') + payload, hashlib.sha256
+        ).hexdigest()
+
+        return self.client.post(
+            reverse('payment:stripe-webhook'),
+            data=payload,
+            content_type='application/json',
+            HTTP_STRIPE_SIGNATURE='t={},v1={}'.format(timestamp, signature)
+        )
+
+    def event(self, event_id='evt_1', event_type='charge.succeeded', **obj):
+
+        return {'id': event_id, 'type': event_type, 'data': {'object': obj}}
+
+    def test_signed_event_is_stored_once(self):
+
+        event = self.event(id='ch_1', metadata={'invoice_id': '100000001'})
+
+        self.assertEqual(self.post(event).status_code, 200)
+        self.assertEqual(self.post(event).status_code, 200)
+
+        self.assertEqual(StripeEvent.objects.filter(event_id='evt_1').count(), 1)
+
+    def test_rejects_invalid_signature(self):
+
+        self.assertEqual(self.post(self.event(), secret='whsec_other').status_code, 400)
+        self.assertFalse(StripeEvent.objects.exists())
+
+    def test_rejects_stale_timestamp(self):
+
+        response = self.post(self.event(), timestamp=int(time.time()) - 3600)
+
+        self.assertEqual(response.status_code, 400)
+
+    def test_rejects_malformed_event(self):
+
+        self.assertEqual(self.post({'type': 'charge.succeeded'}).status_code, 400)
+        self.assertEqual(self.post({'id': 'evt_1', 'type': 'charge.succeeded'}).status_code, 400)
+        self.assertFalse(StripeEvent.objects.exists())
+
+    def test_charge_events_update_payment(self):
+
+        payment = create_payment(create_account())
+
+        metadata = {'invoice_id': '100000001'}
+
+        webhooks.record_event(self.event('evt_1', 'charge.succeeded', id='ch_1', metadata=metadata))
+        webhooks.record_event(self.event('evt_2', 'charge.failed', id='ch_2', metadata=metadata))
+
+        self.assertEqual(webhooks.process_events(10), 2)
+
+        payment.refresh_from_db()
+
+        # A failed attempt never overrides a successful one
+        self.assertEqual(payment.status, constants.PAID)
+        self.assertEqual(payment.stripe_reference, 'ch_1')
+        self.assertEqual(StripeEvent.objects.filter(status=constants.EVENT_DONE).count(), 2)
+
+    def test_claimed_event_is_not_claimed_again(self):
+
+        event = webhooks.record_event(self.event())
+        stale = StripeEvent.objects.get(pk=event.pk)
+
+        self.assertEqual(webhooks.claim([event]), [event])
+        self.assertEqual(webhooks.claim([stale]), [])
+
+    def test_failing_event_is_retried_later(self):
+
+        # customer.updated without a default source cannot be applied
+        event = webhooks.record_event(self.event('evt_1', 'customer.updated', id='cus_1'))
+
+        webhooks.process_events(10)
+
+        event.refresh_from_db()
+
+        self.assertEqual(event.status, constants.EVENT_PENDING)
+        self.assertEqual(event.attempts, 1)
+        self.assertGreater(event.next_attempt, timezone.now())
+
+
+class FakeList(object):
+
+    def __init__(self, items):
+        self.items = items
+        self.params = None
+
+    def __call__(self, **params):
+        self.params = params
+        return self
+
+    def auto_paging_iter(self):
+        return iter(self.items)
+
+
+class GatewayTest(TestCase):
+
+    def test_default_source_id(self):
+
+        expanded = stripe.Customer.construct_from(
+            {'id': 'cus_1', 'default_source': card('card_1', '4242')}, 'sk_test')
+        collapsed = stripe.Customer.construct_from({'id': 'cus_1', 'default_source': 'card_1'}, 'sk_test')
+
+        self.assertEqual(gateway.default_source_id(expanded), 'card_1')
+        self.assertEqual(gateway.default_source_id(collapsed), 'card_1')
+
+    def test_iter_cards_skips_other_sources(self):
+
+        customer = stripe.Customer.construct_from({
+            'id': 'cus_1',
+            'sources': {
+                'object': 'list',
+                'has_more': False,
+                'data': [card('card_1', '4242'), {'id': 'src_1', 'object': 'source'}]
+            }
+        }, 'sk_test')
+
+        self.assertEqual([source['id'] for source in gateway.iter_cards(customer)], ['card_1'])
+
+    def test_find_charge_matches_paid_charge_of_invoice(self):
+
+        charges = FakeList([
+            stripe.Charge.construct_from(
+                {'id': 'ch_1', 'paid': False, 'metadata': {'invoice_id': '100000001'}}, 'sk_test'),
+            stripe.Charge.construct_from(
+                {'id': 'ch_2', 'paid': True, 'metadata': {'invoice_id': '100000002'}}, 'sk_test'),
+            stripe.Charge.construct_from(
+                {'id': 'ch_3', 'paid': True, 'metadata': {'invoice_id': '100000001'}}, 'sk_test'),
+        ])
+
+        patch(self, stripe.Charge, 'list', charges)
+
+        since = timezone.now() - datetime.timedelta(days=2)
+
+        self.assertEqual(gateway.find_charge('cus_1', '100000001', since).id, 'ch_3')
+        self.assertIsNone(gateway.find_charge('cus_1', '100000003', since))
+        self.assertEqual(charges.params['customer'], 'cus_1')
+        self.assertEqual(charges.params['created'], {'gte': calendar.timegm(since.utctimetuple())})
+
+    def test_sync_cards_retrieves_customer_with_default_source(self):
+
+        stripe_customer = StripeCustomer.objects.create(customer_id='cus_1', account=create_account())
+
+        customer = stripe.Customer.construct_from({
+            'id': 'cus_1',
+            'default_source': card('card_1', '4242'),
+            'sources': {'object': 'list', 'has_more': False, 'data': [card('card_1', '4242')]}
+        }, 'sk_test')
+
+        patch(self, gateway, 'retrieve_customer', lambda customer_id: customer)
+
+        cards.sync_cards(stripe_customer)
+
+        self.assertTrue(StripeCard.objects.get(card_id='card_1').is_primary)
+
+
+def charged(**params):
+    return stripe.Charge.construct_from({'id': 'ch_new', 'paid': True}, 'sk_test')
+
+
+def declined(**params):
+    raise stripe.error.CardError('Your card was declined', None, 'card_declined')
+
+
+def unreachable(**params):
+    raise stripe.error.APIConnectionError('Could not connect to Stripe')
+
+
+@override_settings(STRIPE_MAX_RETRIES=2, STRIPE_RETRY_DELAY=0)
+class ChargingTest(TestCase):
+
+    def setUp(self):
+
+        self.account = create_account()
+        StripeCustomer.objects.create(customer_id='cus_1', account=self.account)
+
+        self.calls = []
+
+        patch(self, monthly_charging, 'send_billing_email', lambda payment: None)
+        patch(self, monthly_charging, 'send_charging_failed_email', lambda payment, last4: None)
+        patch(self, gateway, 'find_charge', self.fail_call)
+
+    def fail_call(self, *args, **kwargs):
+        raise AssertionError('Unexpected Stripe call')
+
+    def stub_charge(self, *outcomes):
+
+        # Each call to gateway.charge plays the next outcome
+
+        outcomes = list(outcomes)
+
+        def charge(idempotency_key=None, **params):
+            self.calls.append(idempotency_key)
+            return outcomes.pop(0)(**params)
+
+        patch(self, gateway, 'charge', charge)
+
+    def test_claim_payments_leases_batches(self):
+
+        payments = [create_payment(self.account, str(100000001 + i)) for i in range(3)]
+        pending = Payment.objects.filter(status=constants.INITIATED)
+
+        first = charging.claim_payments(pending, 2)
+        second = charging.claim_payments(pending, 2)
+
+        self.assertEqual(sorted(first), [payments[0].pk, payments[1].pk])
+        self.assertEqual(second, [payments[2].pk])
+        self.assertEqual(charging.claim_payments(pending, 2), [])
+
+        leased = Payment.objects.get(pk=payments[0].pk)
+        self.assertGreater(leased.lease_until, timezone.now())
+        self.assertNotEqual(leased.lease_owner, Payment.objects.get(pk=payments[2].pk).lease_owner)
+
+    def test_expired_lease_is_claimed_again(self):
+
+        payment = create_payment(
+            self.account, lease_until=timezone.now() - datetime.timedelta(seconds=1), lease_owner='dead')
+
+        self.assertEqual(charging.claim_payments(Payment.objects.all(), 10), [payment.pk])
+
+    def test_charge_retries_transient_errors_with_same_key(self):
+
+        self.stub_charge(unreachable, charged)
+
+        self.assertEqual(charging.charge('charge:1', amount=1000).id, 'ch_new')
+        self.assertEqual(self.calls, ['charge:1', 'charge:1'])
+
+    def test_charge_does_not_retry_declines(self):
+
+        self.stub_charge(declined, charged)
+
+        with self.assertRaises(stripe.error.CardError):
+            charging.charge('charge:1', amount=1000)
+
+        self.assertEqual(len(self.calls), 1)
+
+    def test_charge_payment(self):
+
+        payment = create_payment(self.account)
+        self.stub_charge(charged)
+
+        self.assertEqual(monthly_charging.charge_payment(payment.pk), charging.CHARGED)
+
+        payment.refresh_from_db()
+
+        self.assertEqual(payment.status, constants.PAID)
+        self.assertEqual(payment.stripe_reference, 'ch_new')
+        self.assertEqual(self.calls, ['charge:100000001'])
+
+    def test_declined_payment_is_released_for_retry(self):
+
+        payment = create_payment(self.account, lease_until=timezone.now(), lease_owner='worker')
+        self.stub_charge(declined)
+
+        self.assertEqual(monthly_charging.charge_payment(payment.pk), charging.DECLINED)
+
+        payment.refresh_from_db()
+
+        self.assertEqual(payment.status, constants.FAILED)
+        self.assertEqual(payment.charge_attempts, 1)
+        self.assertIsNone(payment.lease_until)
+        self.assertEqual(payment.lease_owner, '')
+
+    def test_unreachable_stripe_leaves_payment_initiated(self):
+
+        payment = create_payment(self.account, lease_until=timezone.now(), lease_owner='worker')
+        self.stub_charge(unreachable, unreachable, unreachable)
+
+        self.assertEqual(monthly_charging.charge_payment(payment.pk), charging.ERROR)
+
+        payment.refresh_from_db()
+
+        self.assertEqual(payment.status, constants.INITIATED)
+        self.assertEqual(payment.charge_attempts, 1)
+        self.assertIsNone(payment.lease_until)
+
+    def test_replayed_payment_takes_over_earlier_charge(self):
+
+        payment = create_payment(self.account, charge_attempts=1)
+        self.stub_charge(charged)
+
+        earlier = stripe.Charge.construct_from({'id': 'ch_earlier', 'paid': True}, 'sk_test')
+        patch(self, gateway, 'find_charge', lambda customer_id, invoice_id, since: earlier)
+
+        self.assertEqual(monthly_charging.charge_payment(payment.pk), charging.CHARGED)
+
+        payment.refresh_from_db()
+
+        self.assertEqual(payment.stripe_reference, 'ch_earlier')
+        self.assertEqual(self.calls, [])
+
+    def test_retry_keeps_license_on_transient_error(self):
+
+        payment = create_payment(self.account, status=constants.FAILED, charge_attempts=1)
+        self.stub_charge(unreachable, unreachable, unreachable)
+        patch(self, gateway, 'find_charge', lambda customer_id, invoice_id, since: None)
+        patch(self, monthly_charging_retry, 'send_license_deactivated_email', self.fail_call)
+
+        self.assertEqual(monthly_charging_retry.retry_payment(payment.pk), charging.ERROR)
+
+        payment.refresh_from_db()
+
+        # Still claimable by the next retry run
+        self.assertEqual(payment.status, constants.FAILED)
+        self.assertEqual(payment.charge_attempts, 1)
+        self.assertEqual(self.calls, ['charge-retry:100000001'] * 3)
+
+    def test_drain_does_not_retry_released_payments(self):
+
+        create_payment(self.account)
+        self.stub_charge(unreachable, unreachable, unreachable)
+
+        patch(self, charging, 'run_charges', lambda payment_ids, process, workers=None: Counter(
+            process(payment_id) for payment_id in payment_ids))
+
+        outcomes = charging.drain(
+            Payment.objects.filter(status=constants.INITIATED), monthly_charging.charge_payment)
+
+        self.assertEqual(outcomes, Counter({charging.ERROR: 1}))
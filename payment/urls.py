@@ -27,5 +27,10 @@ urlpatterns = [
         r'^delete/(?P<card_id>\d+)/$',
         views.delete_card,
         name='delete-card'
+    ),
+    url(
+        r'^webhook/$',
+        views.stripe_webhook,
+        name='stripe-webhook'
     )
 ]
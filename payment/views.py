@@ -6,17 +6,20 @@ from django.contrib import messages
 from django.contrib.auth.decorators import login_required
 from django.core.exceptions import ObjectDoesNotExist
 from django.core.urlresolvers import reverse
-from django.http import HttpResponseRedirect, HttpResponse, HttpResponseServerError
+from django.http import HttpResponseRedirect, HttpResponse, HttpResponseBadRequest
 from django.shortcuts import render
-from django.views.decorators.http import require_GET
+from django.db import transaction
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_GET, require_POST
 
+from payment import gateway
+from payment.cards import serialize_card, store_card
 from payment.models import StripeCard, StripeCustomer
-from payment.utils import is_expired
+from payment.webhooks import is_valid_event, process_in_background, record_event, verify_signature
 
 import stripe
 
 logger = logging.getLogger('django')
-stripe.api_key = settings.STRIPE_API_KEY
 
 
 @login_required
@@ -30,13 +33,10 @@ def get_primary_card_details(request):
         )
 
     try:
+        card_details = serialize_card(
+            StripeCard.objects.get(customer=request.user.account.stripe, is_primary=True))
 
-        customer_id = request.user.account.stripe.customer_id
-        customer = stripe.Customer.retrieve(customer_id)
-        card_details = customer.sources.retrieve(customer.default_source)
-
-    except Exception as e:
-        logger.exception(e)
+    except ObjectDoesNotExist:
         card_details = {}
 
     return HttpResponse(
@@ -52,26 +52,11 @@ def view_cards(request):
         return HttpResponseRedirect(reverse('account:dashboard'))
 
     try:
-
-        if request.user.account.stripe:
-            customer = stripe.Customer.retrieve(request.user.account.stripe.customer_id)
-            cards = customer.sources.all(object='card')
-
-            for c in cards:
-                if c['id'] == customer.default_source:
-                    c['is_primary'] = True
-                else:
-                    c['is_primary'] = False
-                c['db_id'] = StripeCard.objects.get(card_id=c['id']).id
-                c['is_expired'] = is_expired(c['exp_year'], c['exp_month'])
+        cards = request.user.account.stripe.cards.order_by('-is_primary', 'id')
 
     except ObjectDoesNotExist:
         return render(request, 'payment/view_cards.html')
 
-    except Exception as e:
-        logger.exception(e)
-        return HttpResponseServerError(e)
-
     return render(request, 'payment/view_cards.html', {'cards': cards})
 
 
@@ -105,30 +90,17 @@ def add_card(request):
 
             try:
                 stripe_customer = request.user.account.stripe
-                customer = stripe.Customer.retrieve(stripe_customer.customer_id)
-                card = customer.sources.create(card=token)
-
-                card = StripeCard(
-                    card_id=card.id,
-                    customer=stripe_customer,
-                    is_primary=False
-                )
+                card = gateway.add_card(stripe_customer.customer_id, token)
 
-                card.save()
+                store_card(stripe_customer, card, is_primary=False)
 
             except ObjectDoesNotExist:
 
-                customer = stripe.Customer.create(source=token)
+                customer = gateway.create_customer(token)
                 stripe_customer = StripeCustomer(account=request.user.account, customer_id=customer.id)
                 stripe_customer.save()
 
-                card = StripeCard(
-                    card_id=customer.default_source,
-                    customer=stripe_customer,
-                    is_primary=True
-                )
-
-                card.save()
+                store_card(stripe_customer, customer.default_source, is_primary=True)
 
             return HttpResponseRedirect(reverse('payment:view-cards'))
 
@@ -154,9 +126,7 @@ def make_primary_card(request, card_id):
         new_primary.is_primary = True
         new_primary.save()
 
-        customer = stripe.Customer.retrieve(request.user.account.stripe.customer_id)
-        customer.default_source = new_primary.card_id
-        customer.save()
+        gateway.set_default_source(request.user.account.stripe.customer_id, new_primary.card_id)
 
     except Exception as e:
         logger.exception(e)
@@ -174,8 +144,7 @@ def delete_card(request, card_id):
     try:
         deleted_card = StripeCard.objects.get(id=card_id, customer=request.user.account.stripe)
 
-        customer = stripe.Customer.retrieve(request.user.account.stripe.customer_id)
-        response = customer.sources.retrieve(deleted_card.card_id).delete()
+        response = gateway.delete_card(request.user.account.stripe.customer_id, deleted_card.card_id)
 
         if not response['deleted']:
             logger.error('Failed to delete card {}'.format(deleted_card.card_id))
@@ -187,3 +156,29 @@ def delete_card(request, card_id):
         logger.exception(e)
 
     return HttpResponseRedirect(reverse('payment:view-cards'))
+
+
+@csrf_exempt
+@require_POST
+def stripe_webhook(request):
+
+    if not verify_signature(request.body, request.META.get('HTTP_STRIPE_SIGNATURE')):
+        logger.error('Rejected Stripe webhook with an invalid signature')
+        return HttpResponseBadRequest()
+
+    try:
+        event = json.loads(request.body.decode('utf-8'))
+
+    except ValueError:
+        return HttpResponseBadRequest()
+
+    if not is_valid_event(event):
+        logger.error('Rejected malformed Stripe webhook')
+        return HttpResponseBadRequest()
+
+    # Stripe only needs to know the event is stored, it is applied once the
+    # response has been sent
+    if record_event(event):
+        transaction.on_commit(process_in_background)
+
+    return HttpResponse()
@@ -0,0 +1,219 @@
+import datetime
+import hashlib
+import hmac
+import logging
+import time
+
+from django.conf import settings
+from django.db import IntegrityError, connection, transaction
+from django.utils import six, timezone
+
+from gluu_ecommerce.utils import get_pool
+from payment import constants
+from payment.cards import store_card
+from payment.models import Payment, StripeCard, StripeCustomer, StripeEvent
+
+logger = logging.getLogger('billing')
+
+
+def verify_signature(payload, header):
+
+    # Stripe signs '<timestamp>.<payload>' with the endpoint secret and sends
+    # the timestamp and one or more v1 signatures in the Stripe-Signature
+    # header
+
+    if not settings.STRIPE_WEBHOOK_SECRET:
+        return False
+
+    try:
+        items = [item.split('=', 1) for item in header.split(',')]
+        timestamp = int(dict(items)['t'])
+
+    except (AttributeError, KeyError, ValueError):
+        return False
+
+    if abs(time.time() - timestamp) > settings.STRIPE_WEBHOOK_TOLERANCE:
+        return False
+
+    expected = hmac.new(
+        settings.STRIPE_WEBHOOK_SECRET.encode('utf-8'),
+        '{}.'.format(timestamp).encode('utf-8') + payload,
+        hashlib.sha256
+    ).hexdigest()
+
+    return any(
+        hmac.compare_digest(expected, signature)
+        for scheme, signature in items if scheme == 'v1'
+    )
+
+
+def is_valid_event(event):
+
+    return (
+        isinstance(event, dict) and
+        isinstance(event.get('id'), six.string_types) and
+        isinstance(event.get('type'), six.string_types) and
+        isinstance(event.get('data'), dict) and
+        isinstance(event['data'].get('object'), dict)
+    )
+
+
+def record_event(event):
+
+    # Returns the stored event, or None if it was already received
+
+    try:
+        with transaction.atomic():
+            return StripeEvent.objects.create(
+                event_id=event['id'],
+                type=event['type'],
+                payload=event
+            )
+
+    except IntegrityError:
+        logger.info('Ignoring redelivered event {}'.format(event['id']))
+
+
+def process_in_background():
+
+    # Runs on the shared, bounded pool, a burst of events doesn't start a
+    # thread per event
+    get_pool().apply_async(process_events_safely)
+
+
+def process_events_safely():
+
+    try:
+        process_events(settings.STRIPE_EVENT_BATCH_SIZE)
+
+    except Exception as e:
+        logger.exception(e)
+
+    finally:
+        connection.close()
+
+
+def claim(events):
+
+    # Same lease as the idp outbox, only the worker whose conditional update
+    # succeeded applies the event
+
+    lease = timezone.now() + datetime.timedelta(seconds=settings.STRIPE_EVENT_LEASE)
+    claimed = []
+
+    for event in events:
+
+        updated = StripeEvent.objects.filter(
+            pk=event.pk,
+            status=constants.EVENT_PENDING,
+            next_attempt=event.next_attempt
+        ).update(next_attempt=lease)
+
+        if updated:
+            event.next_attempt = lease
+            claimed.append(event)
+
+    return claimed
+
+
+def process_events(batch_size):
+
+    # Events are applied in the order they were received
+
+    events = claim(StripeEvent.objects.filter(
+        status=constants.EVENT_PENDING,
+        next_attempt__lte=timezone.now()
+    ).order_by('received', 'id')[:batch_size])
+
+    for event in events:
+
+        try:
+            with transaction.atomic():
+                apply_event(event.type, event.payload['data']['object'])
+
+                event.status = constants.EVENT_DONE
+                event.processed = timezone.now()
+                event.save()
+
+        except Exception as e:
+            mark_failed(event, e)
+
+    return len(events)
+
+
+def mark_failed(event, error):
+
+    event.attempts += 1
+    event.last_error = str(error)
+
+    if event.attempts >= settings.STRIPE_EVENT_MAX_ATTEMPTS:
+        event.status = constants.EVENT_FAILED
+        logger.error('Giving up on event {}: {}'.format(event, error))
+
+    else:
+        delay = settings.STRIPE_EVENT_RETRY_DELAY * 2 ** (event.attempts - 1)
+        event.next_attempt = timezone.now() + datetime.timedelta(seconds=delay)
+        logger.error('Failed to apply event {}, retrying in {}s: {}'.format(event, delay, error))
+
+    event.save()
+
+
+def apply_event(event_type, obj):
+
+    if event_type in ('customer.source.created', 'customer.source.updated',
+                      'customer.source.expiring'):
+        apply_source(obj)
+
+    elif event_type == 'customer.source.deleted':
+        StripeCard.objects.filter(card_id=obj['id']).delete()
+
+    elif event_type == 'customer.updated':
+        apply_customer(obj)
+
+    elif event_type == 'charge.succeeded':
+        apply_charge(obj, constants.PAID)
+
+    elif event_type == 'charge.failed':
+        apply_charge(obj, constants.FAILED)
+
+
+def apply_source(source):
+
+    if source.get('object') != 'card':
+        return
+
+    stripe_customer = StripeCustomer.objects.filter(customer_id=source['customer']).first()
+
+    if stripe_customer is None:
+        return
+
+    is_primary = StripeCard.objects.filter(
+        card_id=source['id'], is_primary=True).exists()
+
+    store_card(stripe_customer, source, is_primary)
+
+
+def apply_customer(customer):
+
+    cards = StripeCard.objects.filter(customer__customer_id=customer['id'])
+
+    cards.exclude(card_id=customer['default_source']).update(is_primary=False)
+    cards.filter(card_id=customer['default_source']).update(is_primary=True)
+
+
+def apply_charge(charge, status):
+
+    invoice_id = (charge.get('metadata') or {}).get('invoice_id')
+
+    if not invoice_id:
+        return
+
+    payment = Payment.objects.select_for_update().filter(invoice_id=invoice_id).first()
+
+    # A failed attempt never overrides a later successful one
+    if payment is None or payment.status == constants.PAID:
+        return
+
+    payment.status = status
+    payment.stripe_reference = charge['id']
+    payment.save()